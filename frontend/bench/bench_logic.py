@@ -0,0 +1,321 @@
+"""Benchmarks for the hot paths in public/logic.py.
+
+Builds synthetic corpora at several scales (KYC emails, long agreements with
+split-run placeholders, KYC reports with many images) next to the bundled
+templates, and reports throughput, latency percentiles and peak Python memory.
+
+    python bench/bench_logic.py                      # full run
+    python bench/bench_logic.py --quick              # smallest scales only
+    python bench/bench_logic.py --save bench/baseline.json
+    python bench/bench_logic.py --compare bench/baseline.json
+
+Peak memory comes from tracemalloc, so it covers Python allocations only; lxml's
+own buffers are not included.
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import struct
+import sys
+import time
+import tracemalloc
+import zlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PUBLIC = os.path.join(HERE, "..", "public")
+TEMPLATES = os.path.join(PUBLIC, "templates")
+sys.path.insert(0, PUBLIC)
+
+import logic  # noqa: E402
+from docx import Document  # noqa: E402
+
+KYC_LINE_SCALES = [10, 100, 1000, 10000]
+AGREEMENT_PAGE_SCALES = [1, 10, 100, 500]
+AGREEMENT_TABLE_ROW_SCALES = [10, 100, 1000]
+KYC_IMAGE_SCALES = [0, 5, 20, 50]
+PARAGRAPHS_PER_PAGE = 25
+
+LISTING_DATA = {
+    "company": "Benchmark Holdings Ltd",
+    "token": "BNCH",
+    "amount": "25,000",
+    "amountInWords": "TWENTY-FIVE THOUSAND",
+    "jurisdiction": "Cayman Islands",
+    "signdate": "2026-01-15",
+    "listingdate": "2026-02-01",
+    "signname": "Alex Example",
+    "wallets": {"erc20": "0x1111", "trc20": "T2222", "bsc": "", "solana": ""},
+    "walletText": "",
+    "includeTechnicalFee": True,
+}
+
+KYC_DATA = {
+    "name": "Zhang San",
+    "country": "China",
+    "gender": "Male",
+    "id_type": "Passport",
+    "id_number": "E12345678",
+    "dob": "1990-01-01",
+    "submit_ip": "10.0.0.1",
+    "device_type": "iPhone 15",
+}
+
+# --- Synthetic corpora ---
+
+def synthetic_kyc_email(lines, seed=0):
+    """A KYC email with mixed Chinese/English labels, separators, bullets and noise."""
+    rnd = random.Random(seed)
+    labels = [(key, label) for key, group in logic.KYC_LABELS.items() for label in group]
+    values = ["张三", "Male", "女", "护照", "2031-05-01", "1.2.3.4", "China", "iPhone", "未过期", "E12345678"]
+    out = []
+    while len(out) < lines:
+        roll = rnd.random()
+        _key, label = rnd.choice(labels)
+        if roll < 0.45:
+            out.append(f"{label}{rnd.choice([':', '：', ' : ', ' '])}{rnd.choice(values)}")
+        elif roll < 0.65:
+            out.append(label + rnd.choice(["", ":", "："]))
+            out.append(rnd.choice(values))
+        elif roll < 0.8:
+            _other, second = rnd.choice(labels)
+            out.append(f"{rnd.choice(['- ', '• ', ''])}{label}: {rnd.choice(values)} {second}: {rnd.choice(values)}")
+        else:
+            out.append(rnd.choice(["Dear team,", "Please review the case below.", "", "Thanks", "-- ", "Case ref 88213"]))
+    return "\n".join(out[:lines])
+
+def synthetic_agreement(template_bytes, pages):
+    """The template plus `pages` worth of paragraphs whose placeholders are split across runs."""
+    doc = Document(io.BytesIO(template_bytes))
+    splits = [
+        ["Company ", "{{", "company", "}}", " lists ", "{{token}}", "."],
+        ["Dated {{ ", "date }}", " for listing on {{listing", "}}", "."],
+        ["Signed by {{name1}} in {{Jurisdiction}} for ", "{{amount", "}}", " USDT."],
+        ["Plain paragraph without any placeholder, used as filler text for the agreement body."],
+    ]
+    for idx in range(pages * PARAGRAPHS_PER_PAGE):
+        paragraph = doc.add_paragraph()
+        for text in splits[idx % len(splits)]:
+            paragraph.add_run(text)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def synthetic_table_agreement(template_bytes, rows):
+    """The template plus a 4-column table of `rows` rows, with merged and nested cells."""
+    doc = Document(io.BytesIO(template_bytes))
+    table = doc.add_table(rows=rows, cols=4)
+    for idx, row in enumerate(table.rows):
+        cells = row.cells
+        cells[0].text = f"Item {idx}"
+        cells[1].text = "{{company}} / {{token}}" if idx % 5 == 0 else "Fixed cell text"
+        if idx % 10 == 0:
+            cells[2].merge(cells[3]).text = "Merged {{amount}} USDT"
+        elif idx % 10 == 5:
+            cells[3].add_table(rows=1, cols=1).cell(0, 0).text = "Nested {{Jurisdiction}}"
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def synthetic_image(seed, width=2400, height=1800):
+    """A phone-photo-sized JPEG when Pillow is available, else a small noisy PNG."""
+    try:
+        from PIL import Image
+    except ImportError:
+        rnd = random.Random(seed)
+        width, height = 320, 240
+        raw = b"".join(b"\x00" + rnd.randbytes(width * 3) for _ in range(height))
+
+        def chunk(kind, data):
+            return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+        header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+        return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+    random.seed(seed)
+    image = Image.effect_noise((width, height), 40 + seed % 20).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+# --- Measurement ---
+
+def measure(fn, setup=None, min_time=0.5, min_iterations=3, max_iterations=200):
+    """Time fn(setup()) repeatedly; setup runs outside the timed region."""
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < min_iterations or (
+        time.perf_counter() - started < min_time and len(latencies) < max_iterations
+    ):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg)
+        latencies.append(time.perf_counter() - start)
+
+    # One extra untimed run under tracemalloc for the memory peak
+    arg = setup() if setup else None
+    tracemalloc.start()
+    fn(arg)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "iterations": len(latencies),
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p90_ms": _percentile(latencies, 90) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "ops_per_s": len(latencies) / sum(latencies),
+        "peak_python_bytes": peak,
+    }
+
+def _percentile(sorted_values, pct):
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+# --- Cases ---
+
+def _read_template(name):
+    with open(os.path.join(TEMPLATES, name), "rb") as handle:
+        return handle.read()
+
+def kyc_extraction_cases(scales):
+    for lines in scales:
+        text = synthetic_kyc_email(lines)
+        result = measure(lambda _arg: logic.extract_kyc_fields(text))
+        result["mb_per_s"] = len(text.encode()) / 1e6 * result["ops_per_s"]
+        yield f"extract_kyc_fields/lines={lines}", result
+        fuzzy = measure(lambda _arg: logic.extract_kyc_fields(text, fuzzy=True))
+        fuzzy["mb_per_s"] = len(text.encode()) / 1e6 * fuzzy["ops_per_s"]
+        yield f"extract_kyc_fields/fuzzy/lines={lines}", fuzzy
+
+def agreement_cases(scales, table_scales):
+    templates = [("Company.docx", _read_template("Company.docx")), ("Company Waive.docx", _read_template("Company Waive.docx"))]
+    # The bundled templates are the realistic baseline; synthetic pages stress scale
+    sources = [(f"template={name}", blob) for name, blob in templates]
+    sources += [(f"pages={pages}", synthetic_agreement(templates[1][1], pages)) for pages in scales]
+    sources += [(f"table_rows={rows}", synthetic_table_agreement(templates[1][1], rows)) for rows in table_scales]
+    mapping = logic._listing_mapping(LISTING_DATA)
+
+    for label, blob in sources:
+        yield f"replace_placeholders/{label}", measure(
+            lambda doc: logic.replace_placeholders(doc, mapping),
+            setup=lambda blob=blob: Document(io.BytesIO(blob)),
+        )
+        yield f"update_wallet_clause/{label}", measure(
+            lambda doc: logic.update_wallet_clause(doc, LISTING_DATA["wallets"], ""),
+            setup=lambda blob=blob: Document(io.BytesIO(blob)),
+        )
+        yield f"generate_listing_agreement/{label}", measure(
+            lambda _arg, blob=blob: logic.generate_listing_agreement(blob, LISTING_DATA)
+        )
+        compiled = logic.CompiledListingTemplate(blob)
+        yield f"generate_listing_agreement/compiled/{label}", measure(
+            lambda _arg, compiled=compiled: logic.generate_listing_agreement(compiled, LISTING_DATA)
+        )
+        yield f"preview_listing_agreement/compiled/{label}", measure(
+            lambda _arg, compiled=compiled: logic.preview_listing_agreement(compiled, LISTING_DATA)
+        )
+        # One field edited per render, as in the live preview
+        session = logic.ListingPreviewSession(blob)
+        session.update(LISTING_DATA)
+        edits = iter(range(1 << 30))
+        yield f"listing_preview/edit_company/{label}", measure(
+            lambda _arg, session=session: session.update(dict(LISTING_DATA, company=f"Preview Co {next(edits)}"))
+        )
+        yield f"listing_preview/text_edit_company/{label}", measure(
+            lambda _arg, session=session: session.preview(dict(LISTING_DATA, company=f"Preview Co {next(edits)}"))
+        )
+
+def kyc_report_cases(scales):
+    template = _read_template("KYC.docx")
+    pool = [synthetic_image(seed) for seed in range(max(scales) or 1)]
+    for count in scales:
+        images = pool[:count]
+        result = measure(
+            lambda _arg, images=images: logic.fill_kyc_document_logic(template, KYC_DATA, "10001", images),
+            min_iterations=2,
+        )
+        result["input_image_bytes"] = sum(len(img) for img in images)
+        yield f"fill_kyc_document_logic/images={count}", result
+        streamed = measure(
+            lambda _arg, images=images: logic.fill_kyc_document_streaming(template, KYC_DATA, "10001", iter(images)),
+            min_iterations=2,
+        )
+        streamed["input_image_bytes"] = result["input_image_bytes"]
+        yield f"fill_kyc_document_streaming/images={count}", streamed
+    compiled = logic.CompiledKYCTemplate(template)
+    yield "fill_kyc_document_logic/compiled/images=0", measure(
+        lambda _arg: logic.fill_kyc_document_logic(compiled, KYC_DATA, "10001", [])
+    )
+    images = pool[:max(scales)]
+    yield f"preview_kyc_document/compiled/images={len(images)}", measure(
+        lambda _arg: logic.preview_kyc_document(compiled, KYC_DATA, "10001", images)
+    )
+
+# --- Reporting ---
+
+def run(quick=False):
+    groups = [
+        kyc_extraction_cases(KYC_LINE_SCALES[:2] if quick else KYC_LINE_SCALES),
+        agreement_cases(
+            AGREEMENT_PAGE_SCALES[:2] if quick else AGREEMENT_PAGE_SCALES,
+            AGREEMENT_TABLE_ROW_SCALES[:2] if quick else AGREEMENT_TABLE_ROW_SCALES,
+        ),
+        kyc_report_cases(KYC_IMAGE_SCALES[:2] if quick else KYC_IMAGE_SCALES),
+    ]
+    results = {}
+    for group in groups:
+        for name, result in group:
+            results[name] = result
+            print(f"{name:<70} p50 {result['p50_ms']:9.2f} ms  p90 {result['p90_ms']:9.2f} ms  "
+                  f"{result['ops_per_s']:8.2f} ops/s  peak {result['peak_python_bytes'] / 1e6:7.2f} MB", flush=True)
+    return {
+        "meta": {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "engine_version": logic.RENDER_ENGINE_VERSION,
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+def compare(report, baseline_path):
+    with open(baseline_path, encoding="utf-8") as handle:
+        baseline = json.load(handle)["results"]
+    print(f"\nCompared with {baseline_path} (p50; >1.00x is slower):")
+    for name, result in report["results"].items():
+        before = baseline.get(name)
+        if not before:
+            print(f"{name:<70} (new)")
+            continue
+        ratio = result["p50_ms"] / before["p50_ms"] if before["p50_ms"] else float("inf")
+        print(f"{name:<70} {before['p50_ms']:9.2f} -> {result['p50_ms']:9.2f} ms  {ratio:5.2f}x")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="run only the smallest scales")
+    parser.add_argument("--save", metavar="PATH", help="write the results as baseline JSON")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline JSON")
+    args = parser.parse_args(argv)
+
+    report = run(quick=args.quick)
+    if args.compare:
+        compare(report, args.compare)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2, ensure_ascii=False)
+        print(f"\nSaved baseline to {args.save}")
+
+if __name__ == "__main__":
+    main()
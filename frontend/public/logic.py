@@ -1,9 +1,27 @@
 import re
 import io
-from docx import Document
-from docx.shared import Inches
-from docx.oxml import OxmlElement
-from docx.text.paragraph import Paragraph
+import csv
+import os
+import json
+import time
+import contextlib
+import sys
+import copy
+import functools
+import hashlib
+import threading
+import zipfile
+import struct
+import zlib
+import asyncio
+import unicodedata
+from array import array
+from collections import Counter, OrderedDict, deque
+from itertools import islice
+from xml.sax.saxutils import escape as xml_escape
+
+# python-docx and lxml are imported inside the functions that need them, so KYC text
+# extraction can run before (or without) the docx packages being installed
 
 # --- Constants & Helpers ---
 
@@ -33,9 +51,10 @@ def normalize_kyc_template_label(label: str) -> str:
     cleaned = label.strip()
     if not cleaned:
         return cleaned
-    alias = KYC_TEMPLATE_LABEL_ALIASES.get(cleaned)
+    aliases = active_kyc_rules().template_aliases
+    alias = aliases.get(cleaned)
     if not alias:
-        alias = KYC_TEMPLATE_LABEL_ALIASES.get(cleaned.lower())
+        alias = aliases.get(cleaned.lower())
     if alias:
         return alias
     return KYC_LABEL_CANONICAL.get(cleaned.lower(), cleaned)
@@ -43,9 +62,10 @@ def normalize_kyc_template_label(label: str) -> str:
 def _replace_paragraph_text_preserve_format(paragraph, new_text):
     """Replace all text in a paragraph while preserving the first run's formatting (rPr)."""
     if paragraph.runs:
-        paragraph.runs[0].text = new_text
-        for run in paragraph.runs[1:]:
-            run.text = ""
+        runs = paragraph.runs
+        _set_run_text(runs[0], new_text)
+        for run in runs[1:]:
+            _set_run_text(run, "")
     else:
         paragraph.add_run(new_text)
 
@@ -60,12 +80,49 @@ def _replace_cell_text_preserve_format(cell, new_text):
     else:
         cell.text = new_text
 
+# Clark-notation tag names, spelled out so they don't need docx.oxml.ns.qn at import
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P = _W_NS + "p"
+_W_R = _W_NS + "r"
+_W_RPR = _W_NS + "rPr"
+_W_BODY = _W_NS + "body"
+_W_HYPERLINK = _W_NS + "hyperlink"
+# Run children that CT_R.text turns into text
+_RUN_TEXT_TAGS = frozenset(_W_NS + tag for tag in ("t", "tab", "br", "cr", "noBreakHyphen", "ptab"))
+
+def _run_text(r):
+    """CT_R.text for a w:r element, without the XPath query python-docx runs on every call."""
+    return "".join(str(child) for child in r if child.tag in _RUN_TEXT_TAGS)
+
+def _set_run_text(run, text):
+    """run.text = text, without the XPath query CT_R.clear_content runs on every call."""
+    from docx.oxml.text.run import _RunContentAppender
+
+    r = run._r
+    # Everything but the run properties goes, as clear_content's "./*[not(self::w:rPr)]"
+    for child in [child for child in r if isinstance(child.tag, str) and child.tag != _W_RPR]:
+        r.remove(child)
+    _RunContentAppender.append_to_run_from_text(r, text)
+
+def _paragraph_text(paragraph):
+    """paragraph.text (its runs and hyperlinked runs) built from _run_text."""
+    texts = []
+    for child in paragraph._p:
+        if child.tag == _W_R:
+            texts.append(_run_text(child))
+        elif child.tag == _W_HYPERLINK:
+            texts.extend(_run_text(r) for r in child if r.tag == _W_R)
+    return "".join(texts)
+
 def remove_paragraph(paragraph):
     p = paragraph._element
     p.getparent().remove(p)
     p._p = p._element = None
 
 def insert_paragraph_after(paragraph, text=None):
+    from docx.oxml import OxmlElement
+    from docx.text.paragraph import Paragraph
+
     new_p = OxmlElement("w:p")
     paragraph._p.addnext(new_p)
     new_para = Paragraph(new_p, paragraph._parent)
@@ -73,102 +130,242 @@ def insert_paragraph_after(paragraph, text=None):
         new_para.add_run(text)
     return new_para
 
-def document_to_bytes(doc):
+class _BufferReader(io.RawIOBase):
+    """Read-only, seekable file over any buffer-protocol object, without copying it."""
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def readinto(self, buffer):
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        chunk = self._view[self._pos:end]
+        self._pos += len(chunk)
+        return chunk.tobytes()
+
+def _open_buffer(data):
+    """A binary file over bytes, bytearray or memoryview input, without copying the whole buffer."""
+    if isinstance(data, bytes):
+        # BytesIO shares a bytes object until it's written to
+        return io.BytesIO(data)
+    return _BufferReader(data)
+
+def document_to_bytes(doc, template_bytes=None):
+    """Serialize doc to .docx bytes.
+
+    With the template the document was opened from, parts that were not edited are
+    copied as their original compressed zip members instead of being re-deflated.
+    Only story parts (document, headers, footers) and new or changed binary parts are
+    written again, so callers that edit styles or numbering must not pass a template.
+    """
+    if template_bytes is None:
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        buffer.seek(0)
+        return buffer.getvalue()
+
     buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as target:
+        _write_package(doc, template_bytes, target)
     return buffer.getvalue()
 
+def _write_package(doc, template_bytes, target):
+    """Write doc's parts into the open ZipFile target, copying unedited template members raw."""
+    from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+    from docx.opc.pkgwriter import _ContentTypesItem
+
+    package = doc.part.package
+    parts = list(package.iter_parts())
+    for part in parts:
+        part.before_marshal()
+    source = zipfile.ZipFile(_open_buffer(template_bytes))
+    members = {info.filename: info for info in source.infolist()}
+
+    target.writestr(CONTENT_TYPES_URI.membername, _ContentTypesItem.from_parts(parts).blob)
+    target.writestr(PACKAGE_URI.rels_uri.membername, package.rels.xml)
+    for part in parts:
+        name = part.partname.membername
+        info = members.get(name)
+        if getattr(part, "streamed", False):
+            pass  # written into target as it arrived
+        elif info is not None and _part_matches_member(part, info):
+            _copy_zip_member_raw(source, info, target)
+        elif part.content_type in _STORED_CONTENT_TYPES:
+            # Already-compressed media gains nothing from deflate
+            target.writestr(name, part.blob, compress_type=zipfile.ZIP_STORED)
+        else:
+            target.writestr(name, part.blob)
+        if len(part.rels):
+            target.writestr(part.partname.rels_uri.membername, part.rels.xml)
+
+_STORED_CONTENT_TYPES = {"image/jpeg", "image/png", "image/gif"}
+
+def _part_matches_member(part, info):
+    """Whether part can be written as the template's zip member unchanged."""
+    from docx.opc.part import XmlPart
+    from docx.parts.story import StoryPart
+
+    if isinstance(part, StoryPart):
+        return False
+    if isinstance(part, XmlPart):
+        return True
+    # Binary parts are immutable once loaded; the CRC guards against a new part
+    # that happens to reuse the name of an orphaned template member
+    blob = part.blob
+    return len(blob) == info.file_size and zlib.crc32(blob) == info.CRC
+
+def _copy_zip_member_raw(source, info, target):
+    """Append a member of source to target as its original compressed bytes."""
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(30)
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    source.fp.seek(info.header_offset + 30 + name_len + extra_len)
+    raw = source.fp.read(info.compress_size)
+    _write_zip_member_raw(target, info, raw)
+
+def _write_zip_member_raw(target, info, raw):
+    """Append raw (already compressed) member data described by info to target."""
+    clone = zipfile.ZipInfo(info.filename, info.date_time)
+    clone.compress_type = info.compress_type
+    clone.flag_bits = info.flag_bits & ~0x08  # sizes go in the local header, no data descriptor
+    clone.create_system = info.create_system
+    clone.external_attr = info.external_attr
+    clone.CRC = info.CRC
+    clone.compress_size = info.compress_size
+    clone.file_size = info.file_size
+    clone.header_offset = target.fp.tell()
+    # zipfile has no public raw-copy API; this is what ZipFile.writestr does after compressing
+    target.fp.write(clone.FileHeader())
+    target.fp.write(raw)
+    target.filelist.append(clone)
+    target.NameToInfo[clone.filename] = clone
+    target.start_dir = target.fp.tell()
+    target._didModify = True
+
+# --- Story Traversal ---
+
+def iter_story_parts(doc):
+    """The document part, then every header, footer and comments part it relates to, once each."""
+    from docx.parts.story import StoryPart
+
+    yield doc.part
+    seen = {doc.part}
+    for rel in doc.part.rels.values():
+        if rel.is_external:
+            continue
+        part = rel.target_part
+        if isinstance(part, StoryPart) and part not in seen:
+            seen.add(part)
+            yield part
+
+def iter_story_paragraphs(doc):
+    """Yield (part, w:p element) for every paragraph of every story part, each exactly once.
+
+    One lxml walk per part reaches paragraphs at any depth: nested tables, tables in
+    headers and footers, and text box content. No python-docx wrappers are built, and
+    merged cells aren't revisited the way row.cells repeats them.
+    """
+    for part in iter_story_parts(doc):
+        # Collected up front, so callers can edit or remove paragraphs as they go
+        for p in list(part.element.iter(_W_P)):
+            yield part, p
+
 # --- Listing Agreement Logic ---
 
-def replace_placeholders_in_paragraph(paragraph, mapping):
-    if not paragraph.runs:
-        return
+@functools.lru_cache(maxsize=32)
+def _placeholder_regex(keys):
+    """One pattern for every {{key}}, {{ key }}, {{key }} and {{ key}} variant of the given keys."""
+    alternation = "|".join(re.escape(key) for key in sorted(keys, key=len, reverse=True))
+    return re.compile(r"\{\{ ?(" + alternation + r") ?\}\}")
 
-    # Try per-run replacement first (handles most cases, preserves formatting perfectly)
-    found_any = False
-    for run in paragraph.runs:
-        original = run.text
-        new_text = original
-        for key, value in mapping.items():
-            patterns = [
-                f"{{{{{key}}}}}",
-                f"{{{{ {key} }}}}",
-                f"{{{{{key} }}}}",
-                f"{{{{ {key}}}}}",
-            ]
-            for pattern in patterns:
-                new_text = new_text.replace(pattern, str(value or ""))
-        if new_text != original:
-            run.text = new_text
-            found_any = True
-    # Per-run replacement done. Now check for cross-run placeholders
-    # (do NOT return early here — a single paragraph may have both
-    #  single-run and cross-run placeholders, e.g. {{company}} in one run
-    #  and {{Jurisdiction}} split across multiple runs)
-
-    # Cross-run replacement: placeholder is split across runs
-    # Join all run texts and check if any placeholder exists
-    full_text = "".join(run.text for run in paragraph.runs)
-    if not full_text:
-        return
+def replace_placeholders_in_paragraph(paragraph, mapping, trace=None):
+    from lxml import etree
 
-    new_full = full_text
-    for key, value in mapping.items():
-        patterns = [
-            f"{{{{{key}}}}}",
-            f"{{{{ {key} }}}}",
-            f"{{{{{key} }}}}",
-            f"{{{{ {key}}}}}",
-        ]
-        for pattern in patterns:
-            new_full = new_full.replace(pattern, str(value or ""))
+    if trace is not None:
+        trace.count("paragraphs_scanned")
+    # Cheap C-level pre-check: a placeholder needs a "{" in some text node
+    if "{" not in etree.tostring(paragraph._p, method="text", encoding=str, with_tail=False):
+        return
+    runs = paragraph.runs
+    if not runs:
+        return
 
-    if new_full == full_text:
+    run_texts = [_run_text(run._r) for run in runs]
+    full_text = "".join(run_texts)
+    if "{{" not in full_text:
         return
 
-    # Distribute replaced text back across runs, preserving each run's formatting (rPr)
-    runs = paragraph.runs
-    if len(runs) == 1:
-        runs[0].text = new_full
+    # Find all placeholder spans in one scan; the pattern is cached per mapping key set
+    values = {str(key): value for key, value in mapping.items()}
+    if not values:
+        # An empty alternation would match a literal "{{}}"
+        return
+    pattern = _placeholder_regex(frozenset(values))
+    replacements = [(match.start(), match.end(), match.group(1)) for match in pattern.finditer(full_text)]
+    if not replacements:
         return
 
+    pieces, crosses_runs = _placeholder_run_pieces(run_texts, replacements)
+    texts = {key: str(values[key] or "") for _start, _end, key in replacements}
+    new_run_texts = [_join_run_pieces(run_pieces, texts) for run_pieces in pieces]
+
+    # Apply new texts to runs (preserving each run's rPr/formatting). When a placeholder
+    # is split across runs every run is rewritten, as the cross-run pass always did;
+    # otherwise only runs whose text changed are touched.
+    rewritten = 0
+    for i, run in enumerate(runs):
+        if crosses_runs or new_run_texts[i] != run_texts[i]:
+            _set_run_text(run, new_run_texts[i])
+            rewritten += 1
+    if trace is not None:
+        trace.count("placeholders_replaced", len(replacements))
+        trace.count("runs_rewritten", rewritten)
+
+def _join_run_pieces(pieces, texts):
+    return "".join(piece if isinstance(piece, str) else texts[piece[0]] for piece in pieces)
+
+def _placeholder_run_pieces(run_texts, replacements):
+    """Split the runs' text around the (start, end, key) placeholder spans.
+
+    Returns (pieces per run, crosses_runs). A run's new text is its pieces joined,
+    where a str is literal text and a (key,) tuple stands for that key's value; a
+    placeholder split across runs lands entirely in the run where it starts.
+    """
+    full_text = "".join(run_texts)
     # Build char-to-run mapping for the original full_text
     run_boundaries = []  # list of (start, end, run_index)
     pos = 0
-    for i, run in enumerate(runs):
-        length = len(run.text)
+    for i, text in enumerate(run_texts):
+        length = len(text)
         run_boundaries.append((pos, pos + length, i))
         pos += length
 
-    # Find all placeholder spans in the original text and their replacements
-    replacements = []  # (start, end, replacement_value)
-    temp = full_text
-    for key, value in mapping.items():
-        patterns = [
-            f"{{{{{key}}}}}",
-            f"{{{{ {key} }}}}",
-            f"{{{{{key} }}}}",
-            f"{{{{ {key}}}}}",
-        ]
-        for pattern in patterns:
-            idx = 0
-            while True:
-                found = temp.find(pattern, idx)
-                if found == -1:
-                    break
-                replacements.append((found, found + len(pattern), str(value or "")))
-                # Replace in temp so we don't double-match
-                temp = temp[:found] + "\x00" * len(pattern) + temp[found + len(pattern):]
-                idx = found + len(pattern)
-
-    if not replacements:
-        return
-
-    replacements.sort(key=lambda r: r[0])
-
     # Rebuild text for each run using skip_until to handle cross-run placeholders
-    new_run_texts = [''] * len(runs)
+    new_run_pieces = [[] for _ in run_texts]
+    crosses_runs = False
     repl_idx = 0
     skip_until = 0  # global: chars before this position are part of an already-handled replacement
 
@@ -178,15 +375,17 @@ def replace_placeholders_in_paragraph(paragraph, mapping):
         cur = max(r_start, skip_until)
         while cur < r_end:
             if repl_idx < len(replacements):
-                rp_start, rp_end, rp_val = replacements[repl_idx]
+                rp_start, rp_end, rp_key = replacements[repl_idx]
                 if rp_start >= cur and rp_start < r_end:
                     # Replacement starts within this run
                     if rp_start > cur:
                         parts.append(full_text[cur:rp_start])
-                    parts.append(rp_val)
+                    parts.append((rp_key,))
                     repl_idx += 1
                     skip_until = rp_end
                     cur = rp_end
+                    if rp_end > r_end:
+                        crosses_runs = True
                     if cur >= r_end:
                         break
                 elif rp_start >= r_end:
@@ -199,40 +398,98 @@ def replace_placeholders_in_paragraph(paragraph, mapping):
             else:
                 parts.append(full_text[cur:r_end])
                 cur = r_end
-        new_run_texts[ri] = ''.join(parts)
+        new_run_pieces[ri] = parts
+    return new_run_pieces, crosses_runs
 
-    # Apply new texts to runs (preserving each run's rPr/formatting)
-    for i, run in enumerate(runs):
-        run.text = new_run_texts[i]
+def replace_placeholders(doc, mapping, trace=None):
+    """Fill placeholders in every paragraph of the body, headers, footers and comments."""
+    from docx.text.paragraph import Paragraph
 
-def replace_placeholders(doc, mapping):
-    for paragraph in doc.paragraphs:
-        replace_placeholders_in_paragraph(paragraph, mapping)
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    replace_placeholders_in_paragraph(paragraph, mapping)
-    for section in doc.sections:
-        for paragraph in section.header.paragraphs:
-            replace_placeholders_in_paragraph(paragraph, mapping)
-        for paragraph in section.footer.paragraphs:
-            replace_placeholders_in_paragraph(paragraph, mapping)
-        # Handle tables in headers/footers if necessary
-
-def remove_technical_fee_clause(doc):
-    start_regex = re.compile(r"\bA\s+Technical\s+Fee\b", flags=re.IGNORECASE)
+    for _part, p in iter_story_paragraphs(doc):
+        replace_placeholders_in_paragraph(Paragraph(p, None), mapping, trace)
+
+_FEE_START_RE = re.compile(r"\bA\s+Technical\s+Fee\b", flags=re.IGNORECASE)
+_CLAUSE_END_RE = re.compile(r"^(?:[dD]\.\s|(?:IV|IV\.)\b)")
+
+def _clause_markers(text):
+    """(fee_start, fee_literal, clause_end, acknowledge) flags for one body paragraph's text."""
+    stripped = text.strip()
+    return (
+        bool(_FEE_START_RE.search(stripped)),
+        "A Technical Fee" in text,
+        bool(_CLAUSE_END_RE.match(stripped)),
+        stripped.startswith("The Exchange will acknowledge"),
+    )
+
+def _technical_fee_removals(markers):
+    """Indices of the paragraphs in the Technical Fee clause(s), excluding the closing d./IV. line."""
+    removals = []
     clause_started = False
-    paragraphs = list(doc.paragraphs)
-    for paragraph in paragraphs:
-        text = paragraph.text.strip()
-        if not clause_started and start_regex.search(text):
+    for idx, (fee_start, _literal, clause_end, _ack) in enumerate(markers):
+        if not clause_started and fee_start:
             clause_started = True
         if clause_started:
-            if re.match(r"^[dD]\.\s", text) or re.match(r"^(IV|IV\.)\b", text):
+            if clause_end:
                 clause_started = False
                 continue
-            remove_paragraph(paragraph)
+            removals.append(idx)
+    return removals
+
+def _wallet_block_bounds(markers):
+    """(target, end) of the wallet block after the first "A Technical Fee" paragraph, or None."""
+    target = next((idx for idx, m in enumerate(markers) if m[1]), None)
+    if target is None:
+        return None
+    for j in range(target + 1, len(markers)):
+        if markers[j][3] or markers[j][2]:
+            return target, j
+    return target, target + 1
+
+class BodyIndex:
+    """Body-level paragraphs of a document with their clause markers.
+
+    Built once per document so the Technical Fee and wallet edits don't rebuild
+    doc.paragraphs from the XML on every access; remove() and insert_after() keep
+    the lists in sync with the document.
+    """
+
+    def __init__(self, paragraphs, markers=None):
+        self.paragraphs = list(paragraphs)
+        if markers is None:
+            markers = [_clause_markers(_paragraph_text(p)) for p in self.paragraphs]
+        self.markers = list(markers)
+
+    @classmethod
+    def from_document(cls, doc):
+        return cls(doc.paragraphs)
+
+    def remove(self, indices):
+        indices = set(indices)
+        if not indices:
+            return
+        for idx in indices:
+            remove_paragraph(self.paragraphs[idx])
+        self.paragraphs = [p for idx, p in enumerate(self.paragraphs) if idx not in indices]
+        self.markers = [m for idx, m in enumerate(self.markers) if idx not in indices]
+
+    def insert_after(self, idx, texts):
+        """Insert one paragraph per text after paragraphs[idx], in order."""
+        cursor = self.paragraphs[idx]
+        added = []
+        for text in texts:
+            cursor = insert_paragraph_after(cursor, text)
+            added.append(cursor)
+        self.paragraphs[idx + 1:idx + 1] = added
+        self.markers[idx + 1:idx + 1] = [_clause_markers(_paragraph_text(p)) for p in added]
+
+    def set_text(self, idx, text):
+        _replace_paragraph_text_preserve_format(self.paragraphs[idx], text)
+        self.markers[idx] = _clause_markers(_paragraph_text(self.paragraphs[idx]))
+
+def remove_technical_fee_clause(doc, body=None):
+    if body is None:
+        body = BodyIndex.from_document(doc)
+    body.remove(_technical_fee_removals(body.markers))
 
 def wallets_to_text(wallets):
     ordered = [
@@ -248,79 +505,40 @@ def wallets_to_text(wallets):
             lines.append(f"{label}: {val}")
     return "\n".join(lines)
 
-def update_wallet_clause(doc, wallets, wallet_text):
-    target_index = None
-    for idx, paragraph in enumerate(doc.paragraphs):
-        if "A Technical Fee" in paragraph.text:
-            target_index = idx
-            break
-    if target_index is None:
+def update_wallet_clause(doc, wallets, wallet_text, body=None):
+    if body is None:
+        body = BodyIndex.from_document(doc)
+    bounds = _wallet_block_bounds(body.markers)
+    if bounds is None:
         return
+    target_index, end_index = bounds
+    new_text, inserted = _wallet_clause_text(_paragraph_text(body.paragraphs[target_index]), wallets, wallet_text)
+    body.set_text(target_index, new_text)
 
-    paragraph = doc.paragraphs[target_index]
-    base_text = paragraph.text.replace("\u00A0", " ").strip()
+    # Remove the old block content; if no wallets, nothing is inserted in its place
+    body.remove(range(target_index + 1, end_index))
+    if inserted:
+        body.insert_after(target_index, inserted)
+
+def _wallet_clause_text(paragraph_text, wallets, wallet_text):
+    """(new wallet paragraph text, paragraphs to insert after it, possibly empty)."""
+    base_text = paragraph_text.replace("\u00A0", " ").strip()
     confirm_regex = re.compile(r"\s*BitMart confirms the wallet addresses as below:\s*", flags=re.IGNORECASE)
     base_text = confirm_regex.sub(" ", base_text).strip()
     if base_text and not base_text.endswith("."):
         base_text += "."
-        
+
     has_wallets = any(wallets.values()) or bool(wallet_text)
-    
-    if has_wallets:
-        new_text = f"{base_text} BitMart confirms the wallet addresses as below:"
-    else:
-        new_text = base_text
-
-    _replace_paragraph_text_preserve_format(paragraph, new_text)
-
-    # Find end of block and remove old content
-    end_index = None
-    for j in range(target_index + 1, len(doc.paragraphs)):
-        text = doc.paragraphs[j].text.strip()
-        if text.startswith("The Exchange will acknowledge"):
-            end_index = j
-            break
-        if re.match(r"^[dD]\.\s", text) or re.match(r"^(IV|IV\.)\b", text):
-            end_index = j
-            break
-    if end_index is None:
-        end_index = target_index + 1
-
-    block_start = target_index + 1
-    block_end = end_index # exclusive
-
-    # If no wallets, remove everything between
     if not has_wallets:
-        for idx in range(block_end - 1, block_start - 1, -1):
-            remove_paragraph(doc.paragraphs[idx])
-        return
+        return base_text, []
 
-    # If wallets, check for existing placeholder
     final_wallet_text = wallet_text if wallet_text else wallets_to_text(wallets)
     wallet_lines = final_wallet_text.splitlines()
-    
-    # Try to find existing placeholder or addresses to replace
-    placeholder_para = None
-    # Checking paragraphs in the block
-    # Note: doc.paragraphs list changes as we remove, but here we scan first
-    # We should re-scan or be careful with indices. 
-    # Actually safe if we don't modify yet.
-    
-    # But for simplicity, let's just remove the old block and insert new paragraphs
-    for idx in range(block_end - 1, block_start - 1, -1):
-         remove_paragraph(doc.paragraphs[idx])
-         
-    # Now insert new lines
-    cursor = paragraph # The "Technical Fee" paragraph
-    # Insert blank line
-    cursor = insert_paragraph_after(cursor, "")
-    for line in wallet_lines:
-        cursor = insert_paragraph_after(cursor, line)
-    insert_paragraph_after(cursor, "") # Trailing blank line
-
-def generate_listing_agreement(template_bytes, data):
-    doc = Document(io.BytesIO(bytes(template_bytes)))
-    
+
+    # Blank line, wallet lines, trailing blank line after the "Technical Fee" paragraph
+    return f"{base_text} BitMart confirms the wallet addresses as below:", ["", *wallet_lines, ""]
+
+def _listing_mapping(data):
     # Build mapping: add aliases so form field names map to template placeholder names
     # Template uses: {{Jurisdiction}}, {{date}}, {{listing}}, {{name1}}, {{Wallets}}
     # Form sends:    jurisdiction,     signdate, listingdate, signname,   wallets
@@ -335,18 +553,444 @@ def generate_listing_agreement(template_bytes, data):
     for key, value in alias_map.items():
         if key not in mapping:
             mapping[key] = value
+    return mapping
+
+def generate_listing_agreement(template_bytes, data, cache=None, trace=None):
+    """Render a listing agreement.
+
+    Pass a CompiledListingTemplate instead of the template bytes when the same
+    template is rendered repeatedly; it skips re-parsing the package each time.
+    With a RenderCache, identical inputs return the previously rendered bytes.
+    A RenderTrace collects per-stage timings and counters.
+    """
+    if cache is not None:
+        with _stage(trace, "cache_lookup"):
+            key = render_cache_key("listing", template_bytes, data)
+            blob = cache.get(key)
+        if blob is None:
+            blob = generate_listing_agreement(template_bytes, data, trace=trace)
+            cache.put(key, blob)
+        elif trace is not None:
+            trace.count("cache_hits")
+        return blob
+
+    if isinstance(template_bytes, CompiledListingTemplate):
+        return template_bytes.render(data, trace)
+
+    doc = _fill_listing_document(template_bytes, data, trace)
+    with _stage(trace, "document_to_bytes"):
+        return document_to_bytes(doc, template_bytes)
+
+def _fill_listing_document(template_bytes, data, trace=None):
+    """Parse the template and apply every listing edit; shared by renders and previews."""
+    from docx import Document
+
+    with _stage(trace, "parse_template"):
+        doc = Document(_open_buffer(template_bytes))
+    mapping = _listing_mapping(data)
     
     # Placeholders
-    replace_placeholders(doc, mapping)
+    with _stage(trace, "replace_placeholders"):
+        replace_placeholders(doc, mapping, trace)
     
-    # Technical Fee
+    # Technical Fee and wallets share one body index
+    with _stage(trace, "index_body"):
+        body = BodyIndex.from_document(doc)
     if not data.get("includeTechnicalFee", True):
-        remove_technical_fee_clause(doc)
+        with _stage(trace, "remove_technical_fee_clause"):
+            remove_technical_fee_clause(doc, body)
 
     # Wallets
-    update_wallet_clause(doc, data.get("wallets", {}), data.get("walletText", ""))
-    
-    return document_to_bytes(doc)
+    with _stage(trace, "update_wallet_clause"):
+        update_wallet_clause(doc, data.get("wallets", {}), data.get("walletText", ""), body)
+    return doc
+
+# --- Compiled Listing Templates ---
+
+def _element_path(root, element):
+    path = []
+    while element is not root:
+        parent = element.getparent()
+        path.append(parent.index(element))
+        element = parent
+    return tuple(reversed(path))
+
+def _resolve_path(root, path):
+    for index in path:
+        root = root[index]
+    return root
+
+def _runs_text(paragraph):
+    return "".join(_run_text(run._r) for run in paragraph.runs)
+
+class CompiledListingTemplate:
+    """A listing template parsed once, with its placeholder and clause locations indexed.
+
+    render() restores pristine copies of every story part's XML, so the package is
+    shared between renders and only the indexed paragraphs are touched. Renders are
+    serialized with a lock because they reuse the same package.
+    """
+
+    def __init__(self, template_bytes):
+        from docx import Document
+        from docx.text.paragraph import Paragraph
+
+        self.template_bytes = bytes(template_bytes)
+        self.template_digest = hashlib.sha256(self.template_bytes).digest()
+        doc = Document(io.BytesIO(self.template_bytes))
+        self._document_part = doc.part
+
+        # Walk the same paragraphs as replace_placeholders and keep only those whose
+        # runs contain a placeholder
+        self._pristine = dict.fromkeys(iter_story_parts(doc))
+        self._placeholder_paths = [
+            (part, _element_path(part.element, p))
+            for part, p in iter_story_paragraphs(doc)
+            if "{{" in _runs_text(Paragraph(p, None))
+        ]
+
+        body_paragraphs = doc.paragraphs
+        self._body_markers = [_clause_markers(_paragraph_text(p)) for p in body_paragraphs]
+        # Body paragraphs whose clause markers may change once placeholders are filled
+        self._dynamic_body = [idx for idx, p in enumerate(body_paragraphs) if "{{" in _runs_text(p)]
+
+        for part in self._pristine:
+            self._pristine[part] = copy.deepcopy(part.element)
+        self._lock = threading.Lock()
+
+    def render(self, data, trace=None):
+        with self._lock:
+            doc = self._restore(trace)
+            self._fill(doc, data, trace)
+            with _stage(trace, "document_to_bytes"):
+                return document_to_bytes(doc, self.template_bytes)
+
+    def preview(self, data, trace=None):
+        """The filled document as document_preview() blocks, without serializing it.
+
+        Paragraphs that no fill changes keep the blocks previewed from the template
+        the first time, so only the filled paragraphs are walked.
+        """
+        with self._lock:
+            doc = self._restore(trace)
+            # Pair every restored paragraph with its pristine block before anything moves
+            known = dict(zip(doc.element.body.iter(_W_P), self._static_preview))
+            self._fill(doc, data, trace)
+            with _stage(trace, "preview"):
+                return _preview_blocks(doc.element.body, self._style_names, known)
+
+    @functools.cached_property
+    def _style_names(self):
+        from docx.document import Document as DocumentObject
+
+        return _preview_style_names(DocumentObject(self._document_part.element, self._document_part))
+
+    @functools.cached_property
+    def _static_preview(self):
+        """The block of each pristine paragraph in body.iter() order, or None where a fill may change it."""
+        root = self._pristine[self._document_part]
+        body = next(root.iterchildren(_W_BODY))
+        # Placeholder paragraphs (and any holding them in a text box) and candidates for
+        # the wallet paragraph are edited in place; the rest are kept or removed as is
+        dynamic = set()
+        for part, path in self._placeholder_paths:
+            if part is self._document_part:
+                p = _resolve_path(root, path)
+                dynamic.update((p, *p.iterancestors(_W_P)))
+        dynamic.update(p for p, markers in zip(body.iterchildren(_W_P), self._body_markers) if markers[1])
+        blocks = {}
+        _preview_blocks(body, self._style_names, seen=blocks)
+        return [None if p in dynamic else blocks.get(p) for p in body.iter(_W_P)]
+
+    def _restore(self, trace):
+        # Callers hold self._lock until they are done with the returned document
+        from docx.document import Document as DocumentObject
+
+        with _stage(trace, "restore_template"):
+            for part, pristine in self._pristine.items():
+                part._element = copy.deepcopy(pristine)
+            return DocumentObject(self._document_part.element, self._document_part)
+
+    def _fill(self, doc, data, trace):
+        from docx.text.paragraph import Paragraph
+
+        mapping = _listing_mapping(data)
+        body = doc._body
+
+        # Resolve every indexed paragraph before anything moves
+        with _stage(trace, "replace_placeholders"):
+            targets = [Paragraph(_resolve_path(part.element, path), body) for part, path in self._placeholder_paths]
+            for paragraph in targets:
+                replace_placeholders_in_paragraph(paragraph, mapping, trace)
+
+        with _stage(trace, "index_body"):
+            paragraphs = [Paragraph(p, body) for p in doc.element.body.iterchildren(_W_P)]
+            markers = list(self._body_markers)
+            for idx in self._dynamic_body:
+                markers[idx] = _clause_markers(_paragraph_text(paragraphs[idx]))
+            index = BodyIndex(paragraphs, markers)
+
+        if not data.get("includeTechnicalFee", True):
+            with _stage(trace, "remove_technical_fee_clause"):
+                remove_technical_fee_clause(doc, index)
+        with _stage(trace, "update_wallet_clause"):
+            update_wallet_clause(doc, data.get("wallets", {}), data.get("walletText", ""), index)
+
+_COMPILED_LISTING_TEMPLATES = {}
+_COMPILED_TEMPLATE_LIMIT = 4
+
+def get_compiled_listing_template(template_bytes):
+    """Return a CompiledListingTemplate for these bytes, reusing one compiled earlier."""
+    return _get_compiled_template(_COMPILED_LISTING_TEMPLATES, CompiledListingTemplate, template_bytes)
+
+def _get_compiled_template(registry, factory, template_bytes, variant=""):
+    # Hash the caller's buffer in place; it is only copied when something is compiled
+    key = (hashlib.sha1(memoryview(template_bytes)).hexdigest(), variant)
+    compiled = registry.get(key)
+    if compiled is None:
+        compiled = factory(bytes(template_bytes))
+        if len(registry) >= _COMPILED_TEMPLATE_LIMIT:
+            registry.pop(next(iter(registry)))
+        registry[key] = compiled
+    return compiled
+
+# --- Listing Preview Sessions ---
+
+class _FilledParagraph:
+    """A paragraph with placeholders: what each of its runs is made of, and its template runs."""
+
+    __slots__ = (
+        "part", "element", "runs", "run_texts", "pieces", "pristine", "rewritten", "crosses_runs", "body_index",
+    )
+
+    def __init__(self, part, element, runs, run_texts, pieces, crosses_runs, body_index):
+        self.part = part
+        self.element = element
+        self.runs = runs
+        self.run_texts = run_texts
+        self.pieces = pieces
+        self.pristine = [copy.deepcopy(run._r) for run in runs]
+        self.rewritten = [False] * len(runs)
+        self.crosses_runs = crosses_runs
+        self.body_index = body_index
+
+    def fill(self, texts):
+        """Set every run's text from texts (key -> value), as a full render would leave it."""
+        from docx.text.run import Run
+
+        rewritten = 0
+        for i, run in enumerate(self.runs):
+            text = _join_run_pieces(self.pieces[i], texts)
+            if self.crosses_runs or text != self.run_texts[i]:
+                _set_run_text(run, text)
+                self.rewritten[i] = True
+                rewritten += 1
+            elif self.rewritten[i]:
+                # Back to the template text: put the template run back untouched
+                r = copy.deepcopy(self.pristine[i])
+                run._r.addprevious(r)
+                run._r.getparent().remove(run._r)
+                self.runs[i] = Run(r, None)
+                self.rewritten[i] = False
+        return rewritten
+
+class ListingPreviewSession:
+    """One listing agreement kept parsed between renders, for live previews.
+
+    The first update() is a full render that also records, for every placeholder
+    run, the literal text and mapping keys it is made of, and logs the Technical
+    Fee and wallet clause edits so they can be undone. Later updates rewrite only
+    the runs of keys whose value changed, redo the clause edits only when their
+    inputs or the paragraphs they read changed, and re-serialize only the story
+    parts that were touched. The output matches generate_listing_agreement.
+    preview() applies data the same way but returns document_preview() blocks,
+    walking only the paragraphs changed since the previous preview.
+    """
+
+    def __init__(self, template_bytes):
+        if isinstance(template_bytes, CompiledListingTemplate):
+            template_bytes = template_bytes.template_bytes
+        self.template_bytes = bytes(template_bytes)
+        self._lock = threading.Lock()
+        self._doc = None
+
+    def update(self, data, trace=None):
+        """Render data, reusing everything the previous render left that still applies."""
+        with self._lock:
+            self._apply(data, trace)
+            with _stage(trace, "document_to_bytes"):
+                if self._blob is None:
+                    self._blob = document_to_bytes(self._doc, self.template_bytes)
+                    if trace is not None:
+                        trace.count("parts_serialized", sum(1 for _ in iter_story_parts(self._doc)))
+                else:
+                    self._blob = self._serialize(trace)
+                self._dirty = set()
+            return self._blob
+
+    def preview(self, data, trace=None):
+        """Apply data as update() does and return document_preview() blocks instead of bytes."""
+        with self._lock:
+            self._apply(data, trace)
+            with _stage(trace, "preview"):
+                seen = {}
+                blocks = _preview_blocks(self._doc.element.body, self._style_names, self._preview_known, seen)
+                self._preview_known = seen
+                return blocks
+
+    def _apply(self, data, trace):
+        mapping = _listing_mapping(data)
+        texts = {str(key): str(value or "") for key, value in mapping.items()}
+        clause_inputs = (
+            bool(data.get("includeTechnicalFee", True)), copy.deepcopy(data.get("wallets", {})),
+            data.get("walletText", ""),
+        )
+        if self._doc is None or frozenset(texts) != frozenset(self._texts):
+            # New placeholder keys change which spans match, so start over
+            self._rebuild(texts, clause_inputs, trace)
+            return
+
+        changed = {key for key, value in texts.items() if value != self._texts[key]}
+        self._texts = texts
+        redo_clauses = clause_inputs != self._clause_inputs
+        with _stage(trace, "replace_placeholders"):
+            touched = {id(f): f for key in changed for f in self._filled_by_key.get(key, ())}
+            for filled in touched.values():
+                rewritten = filled.fill(texts)
+                if trace is not None:
+                    trace.count("runs_rewritten", rewritten)
+                self._dirty.add(filled.part)
+                # Its preview is stale, and so is that of a paragraph holding it in a text box
+                for p in (filled.element, *filled.element.iterancestors(_W_P)):
+                    self._preview_known.pop(p, None)
+                idx = filled.body_index
+                if idx is None:
+                    continue
+                markers = _clause_markers(_paragraph_text(self._body_paragraphs[idx]))
+                if markers != self._markers[idx] or idx == self._wallet_target:
+                    self._markers[idx] = markers
+                    redo_clauses = True
+        if redo_clauses:
+            with _stage(trace, "update_clauses"):
+                self._undo_clauses()
+                self._apply_clauses(clause_inputs)
+            self._dirty.add(self._doc.part)
+
+    def _rebuild(self, texts, clause_inputs, trace):
+        from docx import Document
+        from docx.text.paragraph import Paragraph
+
+        with _stage(trace, "parse_template"):
+            doc = self._doc = Document(io.BytesIO(self.template_bytes))
+            self._style_names = _preview_style_names(doc)
+            self._preview_known = {}
+        body = doc.element.body
+        paragraphs = [Paragraph(p, doc._body) for p in body.iterchildren(_W_P)]
+        body_positions = {p._p: idx for idx, p in enumerate(paragraphs)}
+
+        self._texts = texts
+        self._filled_by_key = {}
+        with _stage(trace, "replace_placeholders"):
+            pattern = _placeholder_regex(frozenset(texts))
+            for part, p in iter_story_paragraphs(doc):
+                runs = Paragraph(p, None).runs
+                run_texts = [_run_text(run._r) for run in runs]
+                spans = [(m.start(), m.end(), m.group(1)) for m in pattern.finditer("".join(run_texts))]
+                if not spans:
+                    continue
+                pieces, crosses_runs = _placeholder_run_pieces(run_texts, spans)
+                filled = _FilledParagraph(part, p, runs, run_texts, pieces, crosses_runs, body_positions.get(p))
+                rewritten = filled.fill(texts)
+                if trace is not None:
+                    trace.count("placeholders_replaced", len(spans))
+                    trace.count("runs_rewritten", rewritten)
+                for key in {key for _start, _end, key in spans}:
+                    self._filled_by_key.setdefault(key, []).append(filled)
+
+        with _stage(trace, "update_clauses"):
+            # Clause markers are read before any clause edit, as a full render does
+            self._body_paragraphs = paragraphs
+            self._markers = [_clause_markers(_paragraph_text(p)) for p in paragraphs]
+            self._clause_log = []
+            self._apply_clauses(clause_inputs)
+        self._blob = None
+        self._dirty = set()
+
+    def _apply_clauses(self, clause_inputs):
+        """Run the Technical Fee and wallet edits, logging each one for _undo_clauses."""
+        from docx.text.paragraph import Paragraph
+
+        include_fee, wallets, wallet_text = self._clause_inputs = clause_inputs
+        kept = list(range(len(self._body_paragraphs)))
+        if not include_fee:
+            removals = set(_technical_fee_removals(self._markers))
+            for idx in sorted(removals):
+                self._detach(self._body_paragraphs[idx]._p)
+            kept = [idx for idx in kept if idx not in removals]
+
+        self._wallet_target = None
+        bounds = _wallet_block_bounds([self._markers[idx] for idx in kept])
+        if bounds is None:
+            return
+        target_index, end_index = bounds
+        self._wallet_target = kept[target_index]
+        target = self._body_paragraphs[self._wallet_target]
+        new_text, inserted = _wallet_clause_text(_paragraph_text(target), wallets, wallet_text)
+
+        # Edit a copy so the filled paragraph stays intact for the next redo
+        working = copy.deepcopy(target._p)
+        target._p.addprevious(working)
+        self._clause_log.append(("drop", working))
+        self._detach(target._p)
+        cursor = Paragraph(working, target._parent)
+        _replace_paragraph_text_preserve_format(cursor, new_text)
+
+        for idx in kept[target_index + 1:end_index]:
+            self._detach(self._body_paragraphs[idx]._p)
+        for text in inserted:
+            cursor = insert_paragraph_after(cursor, text)
+            self._clause_log.append(("drop", cursor._p))
+
+    def _detach(self, element):
+        parent = element.getparent()
+        self._clause_log.append(("attach", parent, parent.index(element), element))
+        parent.remove(element)
+
+    def _undo_clauses(self):
+        for entry in reversed(self._clause_log):
+            if entry[0] == "drop":
+                entry[1].getparent().remove(entry[1])
+            else:
+                _action, parent, index, element = entry
+                parent.insert(index, element)
+        self._clause_log = []
+
+    def _serialize(self, trace=None):
+        """Copy the previous output, re-serializing only the parts changed since."""
+        from docx.opc.oxml import serialize_part_xml
+
+        blobs = {part.partname.membername: serialize_part_xml(part.element) for part in self._dirty}
+        if trace is not None:
+            trace.count("parts_serialized", len(blobs))
+        if not blobs:
+            return self._blob
+        source = zipfile.ZipFile(_open_buffer(self._blob))
+        out = io.BytesIO()
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                blob = blobs.get(info.filename)
+                if blob is None:
+                    _copy_zip_member_raw(source, info, target)
+                else:
+                    # Previews are short-lived, so favour speed over size
+                    target.writestr(info.filename, blob, compresslevel=1)
+        return out.getvalue()
+
+_LISTING_PREVIEW_SESSIONS = {}
+
+def get_listing_preview_session(template_bytes):
+    """Return the ListingPreviewSession for these template bytes, creating it on first use."""
+    return _get_compiled_template(_LISTING_PREVIEW_SESSIONS, ListingPreviewSession, template_bytes)
 
 # --- KYC Logic ---
 
@@ -472,112 +1116,394 @@ ID_EXPIRED_MAP = {
 def normalize_kyc_value(key, value):
     value = value.strip()
     if not value: return value
-    if key == "gender":
-        return GENDER_MAP.get(value, value)
-    if key == "id_type":
-        return ID_TYPE_MAP.get(value, value)
-    if key == "id_expired":
-        return ID_EXPIRED_MAP.get(value, value)
     if key == "device_id":
         value = re.sub(r"^(id|device\s*id)\s*[:\uff1a]\s*", "", value, flags=re.IGNORECASE)
+    # Value maps see the cleaned value, so rule files never have to list prefixed forms
+    value_map = active_kyc_rules().value_maps.get(key)
+    if value_map:
+        return value_map.get(value, value)
     return value
 
+def _label_trie_pattern(labels):
+    """Render labels as a character-trie regex; greedy optional tails make the longest label win."""
+    trie = {}
+    for label in labels:
+        node = trie
+        for ch in label.lower():
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def render(node):
+        branches = [re.escape(ch) + render(child) for ch, child in node.items() if ch]
+        if not branches:
+            return ""
+        body = "|".join(branches)
+        if "" in node:
+            return f"(?:{body})?"
+        if len(branches) > 1:
+            return f"(?:{body})"
+        return body
+
+    return render(trie)
+
+def _kyc_label_matcher():
+    """(matched label -> key, line regex) of the active rule set, compiled on first use.
+
+    One regex scan per line instead of one regex per label.
+    """
+    rules = active_kyc_rules()
+    return rules.label_key, rules.line_re
+
+def classify_kyc_line(line):
+    """Match the longest KYC label at the start of a line.
+
+    Returns (key, span, label_only) where span covers the label and its separator,
+    or None when the line does not start with a label.
+    """
+    label_key, line_re = _kyc_label_matcher()
+    match = line_re.match(line)
+    if not match:
+        return None
+    key = label_key(match.group(1))
+    end = match.end()
+    return key, (0, end), not line[end:].strip()
+
+# Lowest similarity (1 - edits / label length) a noisy label may have; labels under five
+# characters therefore only match exactly once spacing, case and width are normalized
+FUZZY_KYC_MIN_SCORE = 0.8
+_KYC_COMPACT_RE = re.compile(r"[\W_]+")
+_KYC_SEPARATOR_RE = re.compile(r"[：:]")
+
+def _kyc_compact(text):
+    """NFKC-folded, casefolded text without whitespace or punctuation, e.g. "Submit  IP" -> "submitip"."""
+    return _KYC_COMPACT_RE.sub("", unicodedata.normalize("NFKC", text).casefold())
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+# Word endings that make a different word of a label rather than a misread of it
+_KYC_INFLECTIONS = frozenset(["", "s", "es", "d", "ed", "ing", "er", "ion", "ions"])
+
+def _is_inflection(candidate, label):
+    """True if candidate only differs from label by an inflectional ending ("expires" for "expired")."""
+    common = len(os.path.commonprefix([candidate, label]))
+    return candidate[common:] in _KYC_INFLECTIONS and label[common:] in _KYC_INFLECTIONS
+
+def _bounded_edit_distance(a, b, limit):
+    """Levenshtein distance between a and b, or limit + 1 once it must exceed limit."""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+class _KYCFuzzyIndex:
+    """Bigram index over the compacted KYC labels.
+
+    A candidate is only compared with labels of a similar length that share enough
+    bigrams to be within their edit budget (each edit breaks at most two), so most
+    lines are rejected after a few dictionary lookups. Inflections of a label, such
+    as "expires" for "expired", are different words and never match it.
+    """
+
+    def __init__(self, label_to_key, min_score):
+        self.exact = {}
+        self.labels = []
+        self.postings = {}
+        for label, key in label_to_key.items():
+            compact = _kyc_compact(label)
+            if not compact or compact in self.exact:
+                continue
+            self.exact[compact] = key
+            max_edits = int(len(compact) * (1 - min_score) + 1e-9)
+            grams = _bigrams(compact)
+            if not max_edits or len(grams) <= 2 * max_edits:
+                continue
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(len(self.labels))
+            self.labels.append((compact, key, max_edits, len(grams)))
+        self.max_length = max(map(len, self.exact), default=0)
+
+    def lookup(self, candidate):
+        """(key, label length, score) for the best label, longest first, or None."""
+        key = self.exact.get(candidate)
+        if key is not None:
+            return key, len(candidate), 1.0
+        shared = Counter()
+        for gram in _bigrams(candidate):
+            shared.update(self.postings.get(gram, ()))
+        best = None
+        for idx, count in shared.items():
+            compact, key, max_edits, gram_count = self.labels[idx]
+            if count < gram_count - 2 * max_edits or abs(len(compact) - len(candidate)) > max_edits:
+                continue
+            distance = _bounded_edit_distance(candidate, compact, max_edits)
+            if distance > max_edits or _is_inflection(candidate, compact):
+                continue
+            match = (key, len(compact), 1 - distance / len(compact))
+            if best is None or match[1:] > best[1:]:
+                best = match
+        return best
+
+def _kyc_fuzzy_index():
+    return active_kyc_rules().fuzzy_index
+
+def fuzzy_classify_kyc_line(line):
+    """Like classify_kyc_line, for a line starting with a noisy label such as "Submit  lP".
+
+    The label is the text before the first colon, or else the run of words at the
+    start that best matches a label. Returns (key, span, label_only, score) or None.
+    """
+    index = _kyc_fuzzy_index()
+    separator = _KYC_SEPARATOR_RE.search(line)
+    if separator:
+        candidates = [(line[:separator.start()], separator.end())]
+    else:
+        candidates = []
+        for word in re.finditer(r"\S+", line):
+            candidates.append((line[:word.end()], word.end()))
+            if len(_kyc_compact(candidates[-1][0])) > index.max_length:
+                break
+    best = None
+    for text, end in candidates:
+        match = index.lookup(_kyc_compact(text))
+        # Longest label wins, then the closest match, then the shortest prefix
+        if match and (best is None or match[1:] > best[0][1:]):
+            best = match, end
+    if best is None:
+        return None
+    (key, _length, score), end = best
+    end += len(line[end:]) - len(line[end:].lstrip())
+    return key, (0, end), not line[end:].strip(), score
+
 def is_kyc_label_line(line):
     candidate = line.strip()
     if not candidate: return False
-    for labels in KYC_LABELS.values():
-        for label in labels:
-            if re.match(rf"^{re.escape(label)}\s*[：:]?\s*$", candidate, flags=re.IGNORECASE):
-                return True
-    return False
+    info = classify_kyc_line(candidate)
+    return bool(info and info[2])
 
 def kyc_label_key(line):
     candidate = line.strip()
     if not candidate: return None
-    for key, labels in KYC_LABELS.items():
-        for label in labels:
-             if re.match(rf"^{re.escape(label)}\s*[：:]?\s*$", candidate, flags=re.IGNORECASE):
-                 return key
+    info = classify_kyc_line(candidate)
+    if info and info[2]:
+        return info[0]
     return None
 
-def extract_kyc_inline_pairs(line, result):
-    occurrences = []
-    for key, labels in KYC_LABELS.items():
-        for label in labels:
-            pattern = rf"{re.escape(label)}\s*[：:]?\s*"
-            for match in re.finditer(pattern, line, flags=re.IGNORECASE):
-                occurrences.append((match.start(), match.end(), key, len(label)))
-    if not occurrences:
-        return
-    # Remove shorter overlapping matches at the same position (keep longest label)
-    occurrences.sort(key=lambda item: (item[0], -item[3]))
-    filtered = []
-    last_end = -1
-    for start, end, key, label_len in occurrences:
-        if start < last_end:
-            continue  # Skip: overlaps with a longer label already accepted
-        filtered.append((start, end, key))
-        last_end = end
+def _kyc_inline_values(line, pos=0):
+    # The trie pattern prefers the longest label at each position and finditer never
+    # overlaps, so shorter labels inside a longer one are skipped automatically
+    label_key, line_re = _kyc_label_matcher()
+    filtered = [
+        (match.start(), match.end(), label_key(match.group(1)))
+        for match in line_re.finditer(line, pos)
+    ]
+    values = []
     for idx, (_start, end, key) in enumerate(filtered):
         next_start = filtered[idx + 1][0] if idx + 1 < len(filtered) else len(line)
         raw_value = line[end:next_start].strip()
         raw_value = raw_value.lstrip(":：").strip()
         if not raw_value or is_kyc_label_line(raw_value):
             continue
-        value = normalize_kyc_value(key, raw_value)
-        if key not in result or len(value) > len(result[key]):
+        values.append((key, normalize_kyc_value(key, raw_value)))
+    return values
+
+def _apply_kyc_updates(updates, result, scores=None, score=1.0):
+    # Inline values only replace a shorter one; a label's own value always wins
+    for key, value, overwrite in updates:
+        if overwrite or key not in result or len(value) > len(result[key]):
             result[key] = value
+            if scores is not None:
+                # Inline labels are exact matches; only the line's own label can be fuzzy
+                scores[key] = score if overwrite else 1.0
 
-# Build sorted label list: longest labels first to prevent short labels stealing matches
-_SORTED_LABELS = []
-for key, labels in KYC_LABELS.items():
-    for label in labels:
-        _SORTED_LABELS.append((label, key))
-_SORTED_LABELS.sort(key=lambda x: -len(x[0]))
+def extract_kyc_inline_pairs(line, result):
+    _apply_kyc_updates([(key, value, False) for key, value in _kyc_inline_values(line)], result)
+
+def _kyc_line_updates(lines, infos, idx):
+    """The (key, value, overwrite) updates line idx contributes, in application order.
+
+    A label without a value takes the next line that isn't a bare label (skipping
+    repeats of the same label and blank lines), so this reads ahead of idx.
+    """
+    line = lines[idx]
+    info = infos[idx]
+    # Inline labels after the line's own label; the label itself is covered below
+    updates = [(key, value, False) for key, value in _kyc_inline_values(line, info[1][1] if info else 0)]
+    if info is not None:
+        key, (_start, end), label_only = info
+        value = "" if label_only else line[end:].strip()
+        if value and is_kyc_label_line(value): value = ""
+
+        if not value:
+            j = idx + 1
+            while j < len(lines):
+                if not lines[j]:
+                    j += 1
+                    continue
+                next_info = infos[j]
+                if next_info is None or not next_info[2]: break
+                if next_info[0] != key: break
+                j += 1
+
+            if j < len(lines) and not (infos[j] and infos[j][2]):
+                value = lines[j].strip()
 
-def extract_kyc_fields(text):
+        if value:
+            updates.append((key, normalize_kyc_value(key, value), True))
+    return updates
+
+def extract_kyc_fields(text, fuzzy=False, scores=None):
+    """Extract KYC fields from an email or form dump.
+
+    With fuzzy=True, every line is also matched with fuzzy_classify_kyc_line, and the
+    label that covers more of the line wins, so a longer noisy label beats a shorter
+    exact prefix of it. Pass a dict as scores to receive each field's confidence:
+    1.0 for exact labels, the label similarity for fuzzy ones.
+    """
     lines = [clean_line(line) for line in text.splitlines()]
     lines = [line for line in lines if line]
+    # Classify every line once; the value lookahead reuses these results
+    infos = [classify_kyc_line(line) for line in lines]
+    line_scores = [1.0] * len(lines)
+    if fuzzy:
+        for idx, line in enumerate(lines):
+            match = fuzzy_classify_kyc_line(line)
+            # Longest label wins; on a tie the exact match is kept
+            if match and (infos[idx] is None or match[1][1] > infos[idx][1][1]):
+                infos[idx], line_scores[idx] = match[:3], match[3]
     result = {}
-    idx = 0
-    while idx < len(lines):
-        line = lines[idx]
-        extract_kyc_inline_pairs(line, result)
-        matched = False
-        for label, key in _SORTED_LABELS:
-             pattern = rf"^{re.escape(label)}\s*[：:]?\s*(.*)$"
-             match = re.match(pattern, line, flags=re.IGNORECASE)
-             if not match: continue
-             
-             value = match.group(1).strip()
-             if value and is_kyc_label_line(value): value = ""
-             
-             if not value:
-                 j = idx + 1
-                 while j < len(lines) and not lines[j].strip(): j += 1
-                 while j < len(lines):
-                     label_key = kyc_label_key(lines[j])
-                     if label_key is None: break
-                     if label_key != key: break
-                     j += 1
-                     while j < len(lines) and not lines[j].strip(): j += 1
-                 
-                 if j < len(lines) and not is_kyc_label_line(lines[j]):
-                     value = lines[j].strip()
-             
-             if value:
-                 result[key] = normalize_kyc_value(key, value)
-             matched = True
-             break
-        idx += 1
+    for idx in range(len(lines)):
+        _apply_kyc_updates(_kyc_line_updates(lines, infos, idx), result, scores, line_scores[idx])
     return result
 
+class KYCExtractionSession:
+    """Incremental extract_kyc_fields for text that is edited in place.
+
+    Keeps the cleaned lines, their classification and each line's updates, so an edit
+    only re-classifies the changed lines plus the label lines before them whose value
+    lookahead can reach into the edit. fields always equals extract_kyc_fields(text).
+    """
+
+    def __init__(self, text=""):
+        self._raw = []
+        self._lines = []
+        self._infos = []
+        self._updates = []
+        self.lines_reclassified = 0
+        self.fields = {}
+        self.set_text(text)
+
+    @property
+    def text(self):
+        return "\n".join(self._raw)
+
+    def set_text(self, text):
+        """Replace the whole text, re-extracting only the lines between the common prefix and suffix."""
+        new_raw = text.splitlines()
+        old_raw = self._raw
+        limit = min(len(old_raw), len(new_raw))
+        prefix = 0
+        while prefix < limit and old_raw[prefix] == new_raw[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old_raw[-1 - suffix] == new_raw[-1 - suffix]:
+            suffix += 1
+        return self._splice(prefix, len(old_raw) - suffix, new_raw[prefix:len(new_raw) - suffix])
+
+    def edit(self, start, end, text):
+        """Replace raw lines [start, end) with the lines of text and return the fields."""
+        return self._splice(start, end, text.splitlines())
+
+    def _splice(self, start, end, new_raw):
+        if not 0 <= start <= end <= len(self._raw):
+            raise IndexError(f"Line range {start}:{end} outside 0:{len(self._raw)}")
+        new_lines = [clean_line(line) for line in new_raw]
+        self._raw[start:end] = new_raw
+        self._lines[start:end] = new_lines
+        self._infos[start:end] = [classify_kyc_line(line) if line else None for line in new_lines]
+        self._updates[start:end] = [()] * len(new_lines)
+
+        # Label lines before the edit can look ahead into it, through a run of bare labels
+        dirty = list(range(start, start + len(new_lines)))
+        k = start - 1
+        while k >= 0:
+            if self._lines[k]:
+                info = self._infos[k]
+                if info is None:
+                    break
+                dirty.append(k)
+                if not info[2]:
+                    break
+            k -= 1
+
+        for idx in dirty:
+            if self._lines[idx]:
+                self._updates[idx] = _kyc_line_updates(self._lines, self._infos, idx)
+        self.lines_reclassified += len(new_lines)
+
+        fields = {}
+        for updates in self._updates:
+            if updates:
+                _apply_kyc_updates(updates, fields)
+        self.fields = fields
+        return dict(fields)
+
+def _extract_kyc_record(text):
+    try:
+        return extract_kyc_fields(text), None
+    except Exception as exc:
+        return {}, f"{type(exc).__name__}: {exc}"
+
+def _extract_kyc_chunk(texts):
+    return [_extract_kyc_record(text) for text in texts]
+
+def extract_kyc_fields_batch(texts, max_workers=None, chunk_size=64):
+    """Yield (index, fields, error) for every text, in input order.
+
+    A record that fails yields an empty dict and an error message instead of aborting
+    the batch. With max_workers set on CPython, chunks are fanned out to a process pool;
+    Pyodide has no subprocesses, so it always runs inline.
+    """
+    if not max_workers or sys.platform == "emscripten":
+        for index, text in enumerate(texts):
+            fields, error = _extract_kyc_record(text)
+            yield index, fields, error
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    iterator = iter(texts)
+    pending = deque()
+    index = 0
+    # Workers start with the same rule set, whether they are forked or spawned
+    executor = ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_install_kyc_rules, initargs=(active_kyc_rules().artifact,),
+    )
+    try:
+        while True:
+            # Keep a bounded window of chunks in flight so huge exports stream through
+            while len(pending) < max_workers * 2:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(_extract_kyc_chunk, chunk))
+            if not pending:
+                break
+            for fields, error in pending.popleft().result():
+                yield index, fields, error
+                index += 1
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
 def remove_table_row(row):
     row._tr.getparent().remove(row._tr)
 
-def append_kyc_images(doc, images_bytes_list):
-    if not images_bytes_list:
-        return
+def _add_kyc_images_title(doc):
     title = doc.add_paragraph("KYC Pictures")
     if title.runs:
         title.runs[0].bold = True
@@ -585,28 +1511,166 @@ def append_kyc_images(doc, images_bytes_list):
         title.add_run("KYC Pictures").bold = True
         
     title.paragraph_format.keep_with_next = True
-    
+
+def append_kyc_images(doc, images_bytes_list, trace=None):
+    if not images_bytes_list:
+        return
+    from docx.shared import Inches
+
+    _add_kyc_images_title(doc)
     for img_bytes in images_bytes_list:
         paragraph = doc.add_paragraph()
         paragraph.paragraph_format.keep_together = True
         run = paragraph.add_run()
-        run.add_picture(io.BytesIO(bytes(img_bytes)), width=Inches(3.4))
+        run.add_picture(_open_buffer(img_bytes), width=Inches(KYC_IMAGE_WIDTH_INCHES))
+        if trace is not None:
+            trace.count("images_embedded")
+            trace.count("image_bytes_embedded", memoryview(img_bytes).nbytes)
+
+# --- KYC Image Preprocessing ---
+
+KYC_IMAGE_WIDTH_INCHES = 3.4
+KYC_IMAGE_DPI = 200
+KYC_IMAGE_QUALITY = 85
+# Images at least this large are re-encoded on a thread pool (Pillow releases the GIL)
+_PARALLEL_IMAGE_BYTES = 1024 * 1024
+
+def _preprocess_kyc_image(img_bytes, dpi, quality):
+    """Downscale one image to the embedded width at dpi and re-encode it without EXIF.
+
+    Returns the original bytes when Pillow is unavailable or can't decode the image.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return img_bytes
+    try:
+        with Image.open(_open_buffer(img_bytes)) as source:
+            source_format = source.format
+            max_width = round(KYC_IMAGE_WIDTH_INCHES * dpi)
+            if source_format == "JPEG":
+                # Let the JPEG decoder scale down by 1/2..1/8 while decoding; both sides
+                # stay >= max_width so rotation below can't leave it too narrow
+                source.draft("RGB", (max_width, max_width))
+            # Bake the EXIF orientation into the pixels before the EXIF block is dropped
+            image = ImageOps.exif_transpose(source)
+            if image.width > max_width:
+                height = max(1, round(image.height * max_width / image.width))
+                image = image.resize((max_width, height), Image.LANCZOS)
+            out = io.BytesIO()
+            if source_format in ("PNG", "GIF"):
+                # Keep lossless formats lossless (screenshots, transparency)
+                image.save(out, format="PNG", optimize=True, dpi=(dpi, dpi))
+            else:
+                if image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                image.save(out, format="JPEG", quality=quality, optimize=True, dpi=(dpi, dpi))
+            return out.getvalue()
+    except Exception:
+        return img_bytes
+
+def preprocess_kyc_images(images_bytes_list, dpi=KYC_IMAGE_DPI, quality=KYC_IMAGE_QUALITY, max_workers=4):
+    """Deduplicate KYC images by content hash, then downscale and re-encode each one.
+
+    Order of first appearance is kept. Large images are processed on a thread pool
+    where threads are available (not under Pyodide).
+    """
+    unique = []
+    seen = set()
+    for img_bytes in images_bytes_list or []:
+        digest = hashlib.sha256(img_bytes).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        unique.append(img_bytes)
+
+    large = [idx for idx, img in enumerate(unique) if memoryview(img).nbytes >= _PARALLEL_IMAGE_BYTES]
+    if len(large) < 2 or not max_workers or sys.platform == "emscripten":
+        return [_preprocess_kyc_image(img, dpi, quality) for img in unique]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    processed = list(unique)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {idx: executor.submit(_preprocess_kyc_image, unique[idx], dpi, quality) for idx in large}
+        for idx, img in enumerate(unique):
+            if idx not in futures:
+                processed[idx] = _preprocess_kyc_image(img, dpi, quality)
+        for idx, future in futures.items():
+            processed[idx] = future.result()
+    return processed
+
+def fill_kyc_document_logic(template_bytes, data, account_id, images_bytes_list,
+                            image_dpi=KYC_IMAGE_DPI, image_quality=KYC_IMAGE_QUALITY, cache=None, trace=None):
+    """Fill the KYC template. image_dpi=None embeds the images exactly as given."""
+    if cache is not None:
+        with _stage(trace, "cache_lookup"):
+            key = render_cache_key(
+                "kyc", template_bytes, data, account_id, images_bytes_list, options=(image_dpi, image_quality),
+            )
+            blob = cache.get(key)
+        if blob is None:
+            blob = fill_kyc_document_logic(
+                template_bytes, data, account_id, images_bytes_list, image_dpi, image_quality, trace=trace,
+            )
+            cache.put(key, blob)
+        elif trace is not None:
+            trace.count("cache_hits")
+        return blob
+
+    if isinstance(template_bytes, CompiledKYCTemplate):
+        return template_bytes.render(data, account_id, images_bytes_list, image_dpi, image_quality, trace)
+
+    doc = _fill_kyc_document(template_bytes, data, account_id, trace)
+    if image_dpi is not None:
+        with _stage(trace, "preprocess_images"):
+            images_bytes_list = preprocess_kyc_images(images_bytes_list, image_dpi, image_quality)
+    with _stage(trace, "append_kyc_images"):
+        append_kyc_images(doc, images_bytes_list, trace)
+    with _stage(trace, "document_to_bytes"):
+        return document_to_bytes(doc, template_bytes)
 
-def fill_kyc_document_logic(template_bytes, data, account_id, images_bytes_list):
-    doc = Document(io.BytesIO(bytes(template_bytes)))
+def _fill_kyc_document(template_bytes, data, account_id, trace=None):
+    """Parse the template and fill the account ID and table; images are left to the caller."""
+    from docx import Document
+
+    with _stage(trace, "parse_template"):
+        doc = Document(_open_buffer(template_bytes))
     
     # Account ID
+    with _stage(trace, "account_id"):
+        paragraph = _kyc_account_paragraph(doc, trace)
+        if paragraph is not None and account_id:
+            _replace_paragraph_text_preserve_format(paragraph, f"Account ID with BitMart: {account_id}")
+
+    with _stage(trace, "fill_table"):
+        for key, cell in _prepare_kyc_table(doc, trace):
+            _replace_cell_text_preserve_format(cell, str(data.get(key, "")))
+    return doc
+
+_KYC_LABEL_TO_KEY = {label: key for key, label in KYC_FIELDS}
+
+def _kyc_account_paragraph(doc, trace=None):
+    """The "Account ID with BitMart" paragraph, or None."""
     for paragraph in doc.paragraphs:
+        if trace is not None:
+            trace.count("paragraphs_scanned")
         if paragraph.text.strip().lower().startswith("account id with bitmart"):
-            if account_id:
-                _replace_paragraph_text_preserve_format(paragraph, f"Account ID with BitMart: {account_id}")
-            break
+            return paragraph
+    return None
 
-    label_to_key = {label: key for key, label in KYC_FIELDS}
-    
+def _prepare_kyc_table(doc, trace=None):
+    """Apply the data-independent table edits and return (key, value cell) per field row.
+
+    Picture and verification channel rows are removed and labels are rewritten to
+    their canonical form.
+    """
+    fields = []
     for table in doc.tables:
         for row in list(table.rows):
             if not row.cells: continue
+            if trace is not None:
+                trace.count("rows_scanned")
             raw_label = row.cells[0].text.strip()
             label = normalize_kyc_template_label(raw_label)
             lower_label = label.strip().lower()
@@ -621,10 +1685,1218 @@ def fill_kyc_document_logic(template_bytes, data, account_id, images_bytes_list)
             if label != raw_label:
                 _replace_cell_text_preserve_format(row.cells[0], label)
                 
-            if label in label_to_key:
-                key = label_to_key[label]
-                _replace_cell_text_preserve_format(row.cells[1], str(data.get(key, "")))
+            if label in _KYC_LABEL_TO_KEY:
+                fields.append((_KYC_LABEL_TO_KEY[label], row.cells[1]))
+    return fields
+
+# --- Compiled KYC Templates ---
+
+class CompiledKYCTemplate:
+    """A KYC template with its table layout resolved once.
+
+    Row removal and label normalization are applied at compile time; render() restores
+    a pristine copy of the document XML and only writes the value cells, the account
+    ID and the images. Relationships and image parts added by a render are dropped
+    afterwards so the shared package stays clean.
+    """
+
+    def __init__(self, template_bytes):
+        from docx import Document
+
+        self.template_bytes = bytes(template_bytes)
+        self.template_digest = hashlib.sha256(self.template_bytes).digest()
+        # Row labels are normalized now, with the rules active at compile time
+        self.rules_fingerprint = active_kyc_rules().fingerprint
+        doc = Document(io.BytesIO(self.template_bytes))
+        self._document_part = doc.part
+        root = doc.part.element
+
+        paragraph = _kyc_account_paragraph(doc)
+        self._account_path = None if paragraph is None else _element_path(root, paragraph._p)
+        self._field_paths = [(key, _element_path(root, cell._tc)) for key, cell in _prepare_kyc_table(doc)]
+
+        self._pristine = copy.deepcopy(root)
+        self._rel_ids = set(doc.part.rels)
+        self._image_part_count = len(doc.part.package.image_parts)
+        self._lock = threading.Lock()
+
+    def render(self, data, account_id, images_bytes_list,
+               image_dpi=KYC_IMAGE_DPI, image_quality=KYC_IMAGE_QUALITY, trace=None):
+        if image_dpi is not None:
+            with _stage(trace, "preprocess_images"):
+                images_bytes_list = preprocess_kyc_images(images_bytes_list, image_dpi, image_quality)
+        with self._lock:
+            try:
+                doc = self._fill(data, account_id, trace)
+                with _stage(trace, "append_kyc_images"):
+                    append_kyc_images(doc, images_bytes_list, trace)
+                with _stage(trace, "document_to_bytes"):
+                    return document_to_bytes(doc, self.template_bytes)
+            finally:
+                self._drop_added_parts()
+
+    def preview(self, data, account_id, images_bytes_list=(), trace=None):
+        """The filled document as preview_kyc_document() returns it, without serializing it."""
+        with self._lock:
+            doc = self._fill(data, account_id, trace)
+            return _kyc_preview(doc, images_bytes_list, trace, self._style_names)
+
+    @functools.cached_property
+    def _style_names(self):
+        from docx.document import Document as DocumentObject
+
+        return _preview_style_names(DocumentObject(self._document_part.element, self._document_part))
+
+    def _fill(self, data, account_id, trace):
+        # Callers hold self._lock until they are done with the returned document
+        from docx.document import Document as DocumentObject
+        from docx.table import _Cell
+        from docx.text.paragraph import Paragraph
+
+        part = self._document_part
+        with _stage(trace, "restore_template"):
+            part._element = copy.deepcopy(self._pristine)
+            doc = DocumentObject(part.element, part)
+            body = doc._body
+
+        with _stage(trace, "account_id"):
+            if self._account_path is not None and account_id:
+                paragraph = Paragraph(_resolve_path(part.element, self._account_path), body)
+                _replace_paragraph_text_preserve_format(paragraph, f"Account ID with BitMart: {account_id}")
+
+        with _stage(trace, "fill_table"):
+            cells = [(key, _Cell(_resolve_path(part.element, path), body)) for key, path in self._field_paths]
+            for key, cell in cells:
+                _replace_cell_text_preserve_format(cell, str(data.get(key, "")))
+                if trace is not None:
+                    trace.count("cells_written")
+        return doc
+
+    def _drop_added_parts(self):
+        rels = self._document_part.rels
+        for rId in [rId for rId in rels if rId not in self._rel_ids]:
+            del rels[rId]
+            rels.related_parts.pop(rId, None)
+        del self._document_part.package.image_parts._image_parts[self._image_part_count:]
+
+_COMPILED_KYC_TEMPLATES = {}
+
+def get_compiled_kyc_template(template_bytes):
+    """Return a CompiledKYCTemplate for these bytes and the active KYC rules, reusing one compiled earlier."""
+    return _get_compiled_template(
+        _COMPILED_KYC_TEMPLATES, CompiledKYCTemplate, template_bytes, active_kyc_rules().fingerprint,
+    )
+
+# --- Streaming KYC Images ---
+
+@functools.lru_cache(maxsize=None)
+def _streamed_part_class():
+    from docx.opc.part import Part
+
+    class StreamedPart(Part):
+        """A media part whose bytes were already written to the output zip; it holds none."""
+        streamed = True
+
+    return StreamedPart
+
+def fill_kyc_document_streaming(template_bytes, data, account_id, images, out=None,
+                                image_dpi=KYC_IMAGE_DPI, image_quality=KYC_IMAGE_QUALITY, trace=None):
+    """Fill the KYC template, writing each image into the output zip as it arrives.
+
+    images is an iterable of image buffers, or a callable returning the next one (None
+    when done). Each image is preprocessed, written and released before the next one is
+    requested, so peak memory is about one image plus the document XML. Duplicates are
+    skipped as in preprocess_kyc_images, and the document XML matches
+    fill_kyc_document_logic's. Returns the .docx bytes, or None when writing to a
+    file-like out.
+    """
+    from docx.image.image import Image
+    from docx.opc.constants import RELATIONSHIP_TYPE as RT
+    from docx.opc.packuri import PackURI
+    from docx.oxml.shape import CT_Inline
+    from docx.shared import Inches
+
+    if isinstance(template_bytes, CompiledKYCTemplate):
+        template_bytes = template_bytes.template_bytes
+    doc = _fill_kyc_document(template_bytes, data, account_id, trace)
+
+    part = doc.part
+    used_names = {p.partname for p in part.package.iter_parts()}
+    streamed_part = _streamed_part_class()
+    images = iter(images, None) if callable(images) else iter(images or ())
+    embedded = {}
+    media_number = 0
+    titled = False
+    target_file = io.BytesIO() if out is None else out
+    with zipfile.ZipFile(target_file, "w", zipfile.ZIP_DEFLATED) as target:
+        for img_bytes in images:
+            digest = hashlib.sha256(img_bytes).digest()
+            if digest in embedded and image_dpi is not None:
+                continue
+            if digest not in embedded:
+                if image_dpi is not None:
+                    with _stage(trace, "preprocess_images"):
+                        img_bytes = _preprocess_kyc_image(img_bytes, image_dpi, image_quality)
+                with _stage(trace, "write_images"):
+                    image = Image.from_blob(bytes(img_bytes))
+                    # Same numbering as python-docx: one counter across extensions
+                    media_number += 1
+                    partname = PackURI(f"/word/media/image{media_number}.{image.ext}")
+                    while partname in used_names:
+                        media_number += 1
+                        partname = PackURI(f"/word/media/image{media_number}.{image.ext}")
+                    used_names.add(partname)
+                    compress = zipfile.ZIP_STORED if image.content_type in _STORED_CONTENT_TYPES else zipfile.ZIP_DEFLATED
+                    target.writestr(partname.membername, image.blob, compress_type=compress)
+                    rId = part.relate_to(streamed_part(partname, image.content_type, package=part.package), RT.IMAGE)
+                    cx, cy = image.scaled_dimensions(Inches(KYC_IMAGE_WIDTH_INCHES), None)
+                    embedded[digest] = (rId, image.filename, cx, cy)
+                    if trace is not None:
+                        trace.count("images_embedded")
+                        trace.count("image_bytes_embedded", len(image.blob))
+                    del image
+            del img_bytes
+
+            rId, filename, cx, cy = embedded[digest]
+            if not titled:
+                _add_kyc_images_title(doc)
+                titled = True
+            paragraph = doc.add_paragraph()
+            paragraph.paragraph_format.keep_together = True
+            paragraph.add_run()._r.add_drawing(CT_Inline.new_pic_inline(part.next_id, rId, filename, cx, cy))
+
+        with _stage(trace, "document_to_bytes"):
+            _write_package(doc, template_bytes, target)
+    return target_file.getvalue() if out is None else None
+
+# --- Text Previews ---
+
+_W_TBL = _W_NS + "tbl"
+_W_TR = _W_NS + "tr"
+_W_TC = _W_NS + "tc"
+_W_SDT = _W_NS + "sdt"
+_W_SDT_CONTENT = _W_NS + "sdtContent"
+_W_T = _W_NS + "t"
+_W_PPR = _W_NS + "pPr"
+_W_PSTYLE = _W_NS + "pStyle"
+_W_JC = _W_NS + "jc"
+_W_B = _W_NS + "b"
+_W_I = _W_NS + "i"
+_W_U = _W_NS + "u"
+_W_VAL = _W_NS + "val"
+_A_BLIP = "{http://schemas.openxmlformats.org/drawingml/2006/main}blip"
+_R_EMBED = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed"
+_PREVIEW_OFF = {"0", "false", "off"}
+
+def document_preview(doc, style_names=None):
+    """The body of doc as plain blocks for on-screen review, in document order.
+
+    A paragraph is {"type": "paragraph", "text", "style", "align", "runs", "images"}:
+    style is the paragraph style name and align the w:jc value (None when inherited),
+    runs merges neighbouring runs with the same direct bold/italic/underline, and
+    images lists the relationship ids of pictures in the paragraph. A table is
+    {"type": "table", "rows": [[cell blocks, ...], ...]}.
+
+    style_names (style id -> name) can be passed in when the styles are known to be
+    unchanged; walking doc.styles costs more than the body of a short document.
+    """
+    if style_names is None:
+        style_names = _preview_style_names(doc)
+    return _preview_blocks(doc.element.body, style_names)
+
+def _preview_style_names(doc):
+    return {style.style_id: style.name for style in doc.styles}
+
+def _preview_blocks(container, style_names, known=None, seen=None):
+    """Blocks for the children of a body, table cell or content control.
+
+    A paragraph found in known keeps the block previewed for it before, and every
+    paragraph's block is recorded in seen. Reused blocks are shared between calls,
+    so callers must treat them as read-only.
+    """
+    blocks = []
+    for child in container.iterchildren():
+        if child.tag == _W_P:
+            block = known.get(child) if known else None
+            if block is None:
+                block = _preview_paragraph(child, style_names)
+            if seen is not None:
+                seen[child] = block
+            blocks.append(block)
+        elif child.tag == _W_TBL:
+            rows = [
+                [_preview_blocks(tc, style_names, known, seen) for tc in tr.iterchildren(_W_TC)]
+                for tr in child.iterchildren(_W_TR)
+            ]
+            blocks.append({"type": "table", "rows": rows})
+        elif child.tag == _W_SDT:
+            content = next(child.iterchildren(_W_SDT_CONTENT), None)
+            if content is not None:
+                blocks.extend(_preview_blocks(content, style_names, known, seen))
+    return blocks
+
+def _preview_paragraph(p, style_names):
+    # One pass over plain child iteration: lxml's find()/iterchildren() cost more
+    # per call than walking a paragraph's few children
+    runs = []  # [(bold, italic, underline), [text, ...]] per merged run
+    images = []
+    style = align = None
+    for child in p:
+        tag = child.tag
+        if tag == _W_R:
+            _preview_run(child, runs, images)
+        elif tag == _W_HYPERLINK:
+            for r in child:
+                if r.tag == _W_R:
+                    _preview_run(r, runs, images)
+        elif tag == _W_PPR:
+            for prop in child:
+                if prop.tag == _W_PSTYLE:
+                    style = style_names.get(prop.get(_W_VAL))
+                elif prop.tag == _W_JC:
+                    align = prop.get(_W_VAL)
+    runs = [
+        {"text": "".join(texts), "bold": bold, "italic": italic, "underline": underline}
+        for (bold, italic, underline), texts in runs
+    ]
+    return {
+        "type": "paragraph",
+        "text": "".join(run["text"] for run in runs),
+        "style": style,
+        "align": align,
+        "runs": runs,
+        "images": images,
+    }
+
+def _preview_run(r, runs, images):
+    bold = italic = underline = False
+    texts = []
+    plain = True
+    for child in r:
+        tag = child.tag
+        if tag == _W_T:
+            texts.append(child.text or "")
+        elif tag == _W_RPR:
+            for prop in child:
+                if prop.tag == _W_B:
+                    bold = prop.get(_W_VAL) not in _PREVIEW_OFF
+                elif prop.tag == _W_I:
+                    italic = prop.get(_W_VAL) not in _PREVIEW_OFF
+                elif prop.tag == _W_U:
+                    underline = prop.get(_W_VAL) != "none"
+        else:
+            plain = False
+    if not plain:
+        # Tabs, breaks and the like are spelled out by python-docx; pictures become refs
+        texts = [_run_text(r)]
+        images.extend(blip.get(_R_EMBED) for blip in r.iter(_A_BLIP))
+    text = "".join(texts)
+    if not text:
+        return
+    formatting = (bold, italic, underline)
+    if runs and runs[-1][0] == formatting:
+        runs[-1][1].append(text)
+    else:
+        runs.append((formatting, [text]))
+
+def preview_listing_agreement(template_bytes, data, trace=None):
+    """Fill a listing agreement as generate_listing_agreement does and return its
+    document_preview() blocks.
+
+    Nothing is serialized. From template bytes the template is still parsed on every
+    call; a CompiledListingTemplate or a ListingPreviewSession is the one to poll.
+    """
+    if isinstance(template_bytes, CompiledListingTemplate):
+        return template_bytes.preview(data, trace)
+    doc = _fill_listing_document(template_bytes, data, trace)
+    with _stage(trace, "preview"):
+        return document_preview(doc)
+
+def preview_kyc_document(template_bytes, data, account_id, images_bytes_list=(), trace=None):
+    """Fill the KYC template as fill_kyc_document_logic does and return its
+    document_preview() blocks.
+
+    Images are neither decoded nor embedded: the "KYC Pictures" title is followed by
+    one {"type": "image", "ref", "sha256"} block per distinct image, where ref is the
+    image's index in images_bytes_list.
+    """
+    if isinstance(template_bytes, CompiledKYCTemplate):
+        return template_bytes.preview(data, account_id, images_bytes_list, trace)
+    doc = _fill_kyc_document(template_bytes, data, account_id, trace)
+    return _kyc_preview(doc, images_bytes_list, trace)
+
+def _kyc_preview(doc, images_bytes_list, trace=None, style_names=None):
+    with _stage(trace, "preview"):
+        # Same first-appearance deduplication as preprocess_kyc_images
+        refs = {}
+        for index, img_bytes in enumerate(images_bytes_list or ()):
+            refs.setdefault(hashlib.sha256(img_bytes).hexdigest(), index)
+        if refs:
+            _add_kyc_images_title(doc)
+        blocks = document_preview(doc, style_names)
+        blocks.extend({"type": "image", "ref": index, "sha256": digest} for digest, index in refs.items())
+        return blocks
+
+# --- KYC Rule Sets ---
+
+# Bump when the artifact layout or how rules compile changes, to retire cached artifacts
+_KYC_RULES_ARTIFACT_VERSION = 2
+# Header names (lowercased) accepted for each rule column in a spreadsheet
+_KYC_RULE_COLUMNS = {
+    "label": ("form field (label)", "label", "标签"),
+    "key": ("word template field (key)", "key", "字段"),
+    "value": ("value", "原值"),
+    "normalized": ("normalized", "标准值"),
+}
+_XLSX_NS = {"m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+def default_kyc_rules():
+    """The built-in rule set, in the same shape as a JSON rule file."""
+    return {
+        "version": "builtin",
+        "labels": KYC_LABELS,
+        "value_maps": {"gender": GENDER_MAP, "id_type": ID_TYPE_MAP, "id_expired": ID_EXPIRED_MAP},
+        "template_aliases": KYC_TEMPLATE_LABEL_ALIASES,
+    }
+
+class KYCRules:
+    """A compiled label/normalization rule set, built from a JSON-safe artifact.
+
+    The artifact holds everything derived at compile time (the longest-first label
+    map and the trie pattern), so loading a cached one is a JSON read plus one
+    re.compile.
+    """
+
+    def __init__(self, artifact):
+        self.artifact = artifact
+        self.version = artifact["version"]
+        self.digest = artifact["digest"]
+        self.labels = artifact["labels"]
+        self.label_to_key = dict(artifact["label_to_key"])
+        self.line_re = re.compile(rf"({artifact['pattern']})\s*[：:]?\s*", flags=re.IGNORECASE)
+        self.value_maps = artifact["value_maps"]
+        self.template_aliases = artifact["template_aliases"]
+
+    @classmethod
+    def compile(cls, rules, digest=""):
+        # Longest labels first so a short label never claims a longer one's lowercase form
+        sorted_labels = sorted(
+            ((label, key) for key, labels in rules["labels"].items() for label in labels),
+            key=lambda x: -len(x[0]),
+        )
+        label_to_key = {}
+        for label, key in sorted_labels:
+            label_to_key.setdefault(label.lower(), key)
+        return cls({
+            "format": _KYC_RULES_ARTIFACT_VERSION,
+            "version": rules.get("version") or f"rules:{digest[:12]}",
+            "digest": digest,
+            "labels": rules["labels"],
+            "label_to_key": list(label_to_key.items()),
+            "pattern": _label_trie_pattern(label_to_key),
+            "value_maps": rules.get("value_maps", {}),
+            "template_aliases": rules.get("template_aliases", {}),
+        })
+
+    def label_key(self, label):
+        """The key of a label line_re matched, in whatever case it was written."""
+        key = self.label_to_key.get(label.lower())
+        if key is None:
+            # IGNORECASE also matches characters whose lower() differs, like ſ, ı and İ
+            key = next(
+                key for known, key in self.label_to_key.items()
+                if re.fullmatch(re.escape(known), label, flags=re.IGNORECASE)
+            )
+        return key
+
+    @functools.cached_property
+    def fingerprint(self):
+        """Hash of the compiled rules, for keys of anything rendered under them."""
+        return hashlib.sha256(json.dumps(self.artifact, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    @functools.cached_property
+    def fuzzy_index(self):
+        return _KYCFuzzyIndex(self.label_to_key, FUZZY_KYC_MIN_SCORE)
+
+_active_kyc_rules = None
+
+def active_kyc_rules():
+    """The rule set extraction uses; the built-in one is compiled on first use."""
+    global _active_kyc_rules
+    if _active_kyc_rules is None:
+        _active_kyc_rules = KYCRules.compile(default_kyc_rules(), "builtin")
+    return _active_kyc_rules
+
+def use_kyc_rules(rules):
+    """Make rules (a KYCRules, or None for the built-in set) the active rule set.
+
+    Meant for start-up: KYCExtractionSession objects keep the lines they already classified.
+    """
+    global _active_kyc_rules
+    _active_kyc_rules = rules
+
+def _install_kyc_rules(artifact):
+    use_kyc_rules(KYCRules(artifact))
+
+def _merge_kyc_rules(base, rules):
+    """rules layered over base: label lists are extended, value maps and aliases updated."""
+    if not rules.get("extends_builtin", True):
+        return rules
+    labels = {key: list(values) for key, values in base["labels"].items()}
+    for key, values in rules.get("labels", {}).items():
+        labels[key] = list(values) + [label for label in labels.get(key, []) if label not in values]
+    value_maps = {key: dict(mapping) for key, mapping in base["value_maps"].items()}
+    for key, mapping in rules.get("value_maps", {}).items():
+        value_maps.setdefault(key, {}).update(mapping)
+    return {
+        "version": rules.get("version"),
+        "labels": labels,
+        "value_maps": value_maps,
+        "template_aliases": {**base["template_aliases"], **rules.get("template_aliases", {})},
+    }
+
+def _xlsx_rows(blob):
+    """Cell texts of the first worksheet of an .xlsx, row by row (stdlib only)."""
+    import xml.etree.ElementTree as ElementTree
+
+    source = zipfile.ZipFile(io.BytesIO(blob))
+    names = set(source.namelist())
+    strings = []
+    if "xl/sharedStrings.xml" in names:
+        root = ElementTree.fromstring(source.read("xl/sharedStrings.xml"))
+        strings = ["".join(si.itertext()) for si in root.findall("m:si", _XLSX_NS)]
+    sheet = min(
+        (name for name in names if re.fullmatch(r"xl/worksheets/sheet\d+\.xml", name)),
+        key=lambda name: int(re.search(r"\d+", name.rsplit("/", 1)[1]).group()),
+    )
+    for row in ElementTree.fromstring(source.read(sheet)).iterfind("m:sheetData/m:row", _XLSX_NS):
+        cells = {}
+        for cell in row.findall("m:c", _XLSX_NS):
+            column = re.match(r"[A-Z]+", cell.get("r", "")).group()
+            value = cell.find("m:v", _XLSX_NS)
+            if cell.get("t") == "s" and value is not None:
+                cells[column] = strings[int(value.text)]
+            elif cell.get("t") == "inlineStr":
+                cells[column] = "".join(cell.itertext())
+            elif value is not None:
+                cells[column] = value.text or ""
+        yield cells
+
+def _parse_kyc_rules_xlsx(blob):
+    """A rule file from a spreadsheet laid out like the ops team's regex summary.
+
+    The first row names the columns (see _KYC_RULE_COLUMNS). Each later row adds a
+    label for its key and/or a value -> normalized mapping; the regex column is not
+    used. Rows whose key is not a KYC field (the sheet also lists the listing form)
+    are skipped.
+    """
+    rows = _xlsx_rows(blob)
+    header = next(rows, {})
+    columns = {}
+    for column, title in header.items():
+        for field, titles in _KYC_RULE_COLUMNS.items():
+            if title.strip().lower() in titles:
+                columns[field] = column
+    if "key" not in columns:
+        raise ValueError("Rule sheet has no key column")
+
+    rules = {"labels": {}, "value_maps": {}}
+    kyc_rows = 0
+    for cells in rows:
+        row = {field: cells.get(column, "").strip() for field, column in columns.items()}
+        key = row["key"]
+        if key not in KYC_LABELS:
+            continue
+        kyc_rows += 1
+        label = row.get("label", "").rstrip(":：").strip()
+        if label and label not in rules["labels"].setdefault(key, []):
+            rules["labels"][key].append(label)
+        if row.get("value") and row.get("normalized"):
+            rules["value_maps"].setdefault(key, {})[row["value"]] = row["normalized"]
+    if not kyc_rows:
+        raise ValueError(f"Rule sheet has no KYC rows (keys must be one of {', '.join(KYC_LABELS)})")
+    return rules
+
+def load_kyc_rules(source, cache_dir=None):
+    """Compile a rule file (.xlsx or JSON; a path or bytes) over the built-in rules.
+
+    A JSON rule file looks like default_kyc_rules(); set "extends_builtin": false to
+    replace the built-in rules instead. With cache_dir, the compiled artifact is
+    stored under a hash of the file and the built-in rules, so a warm start reads it
+    back instead of parsing and compiling again.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as handle:
+            blob = handle.read()
+    else:
+        blob = bytes(source)
+    base = default_kyc_rules()
+    hasher = hashlib.sha256(b"%d\0" % _KYC_RULES_ARTIFACT_VERSION)
+    hasher.update(json.dumps(base, sort_keys=True, ensure_ascii=False).encode())
+    hasher.update(b"\0" + blob)
+    digest = hasher.hexdigest()
+
+    path = os.path.join(cache_dir, f"kyc-rules-{digest}.json") if cache_dir else None
+    if path:
+        try:
+            with open(path, encoding="utf-8") as handle:
+                return KYCRules(json.load(handle))
+        except (OSError, ValueError, KeyError):
+            pass  # missing or unreadable: compile again
+
+    if blob.startswith(b"PK"):
+        rules = _parse_kyc_rules_xlsx(blob)
+    else:
+        rules = json.loads(blob.decode("utf-8-sig"))
+    compiled = KYCRules.compile(_merge_kyc_rules(base, rules), digest)
+
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(compiled.artifact, handle, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    return compiled
+
+# --- KYC Result Store ---
+
+_XML_INVALID_CHARS_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_XLSX_MAX_ROWS = 1048576
+_XLSX_MAX_CELL_CHARS = 32767
+_XLSX_ROWS_PER_WRITE = 1000
+_XLSX_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_XLSX_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/sharedStrings.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{_XLSX_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<workbook xmlns="{_XLSX_MAIN_NS}" xmlns:r="{_XLSX_REL_NS}">'
+        '<sheets><sheet name="KYC" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{_XLSX_REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{_XLSX_REL_NS}/sharedStrings" Target="sharedStrings.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+def _xlsx_column_letters(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _xlsx_text(value):
+    """A <t> element for value, cut to Excel's cell limit and stripped of XML-illegal characters."""
+    value = _XML_INVALID_CHARS_RE.sub("", value)[:_XLSX_MAX_CELL_CHARS]
+    space = ' xml:space="preserve"' if value != value.strip() else ""
+    return f"<t{space}>{xml_escape(value)}</t>"
+
+class KYCResultStore:
+    """Columnar store for bulk KYC extraction results, one column per KYC_LABELS key.
+
+    Cells are indices into one interned string table, so values repeated across rows
+    (countries, genders, ID types) are kept once and a row costs a few bytes per
+    column. Each row also keeps its source offsets and any extraction error. The
+    exports write row by row, and the XLSX shared strings table is the interned table
+    itself, so neither export builds the sheet in memory.
+    """
+
+    def __init__(self, keys=None):
+        self.keys = tuple(keys or active_kyc_rules().labels)
+        self._strings = [""]
+        self._string_ids = {"": 0}
+        self._columns = {key: array("I") for key in self.keys}
+        self._starts = array("Q")
+        self._ends = array("Q")
+        self._errors = {}
+
+    @classmethod
+    def from_texts(cls, texts, max_workers=None, chunk_size=64, keys=None):
+        """Extract every text with extract_kyc_fields_batch into a new store.
+
+        Source offsets are character offsets into the texts read back to back, e.g.
+        positions in the export file the emails were split from.
+        """
+        store = cls(keys)
+        lengths = deque()
+
+        def measured():
+            for text in texts:
+                # A non-string record fails in extraction and occupies no source text
+                lengths.append(len(text) if isinstance(text, str) else 0)
+                yield text
+
+        position = 0
+        for _index, fields, error in extract_kyc_fields_batch(measured(), max_workers, chunk_size):
+            length = lengths.popleft()
+            store.append(fields, error, position, position + length)
+            position += length
+        return store
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        return (self.row(idx) for idx in range(len(self)))
+
+    def _intern(self, value):
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return string_id
+
+    def append(self, fields, error=None, start=0, end=0):
+        """Add one record; keys outside the store's columns are ignored."""
+        for key, column in self._columns.items():
+            column.append(self._intern(fields.get(key, "")))
+        if error:
+            self._errors[len(self._starts)] = error
+        self._starts.append(start)
+        self._ends.append(end)
+
+    def row(self, idx):
+        """The fields of row idx, as extract_kyc_fields returned them (empty values omitted)."""
+        row = {}
+        for key, column in self._columns.items():
+            string_id = column[idx]
+            if string_id:
+                row[key] = self._strings[string_id]
+        return row
+
+    def column(self, key):
+        strings = self._strings
+        return (strings[string_id] for string_id in self._columns[key])
+
+    def span(self, idx):
+        return self._starts[idx], self._ends[idx]
+
+    def error(self, idx):
+        return self._errors.get(idx)
+
+    def headers(self):
+        labels = dict(KYC_FIELDS)
+        return [labels.get(key, key.replace("_", " ").title()) for key in self.keys] + [
+            "Error", "Source Start", "Source End",
+        ]
+
+    def write_csv(self, out, escape_formulas=True):
+        """Write a header and one line per row to the text stream out.
+
+        Open files with newline="" (and encoding="utf-8-sig" for Excel). Values that a
+        spreadsheet would run as a formula get a leading apostrophe unless
+        escape_formulas is False.
+        """
+        strings = self._strings
+        if escape_formulas:
+            strings = ["'" + value if value.startswith(("=", "+", "-", "@", "\t", "\r")) else value for value in strings]
+        columns = list(self._columns.values())
+        writer = csv.writer(out)
+        writer.writerow(self.headers())
+        for idx in range(len(self)):
+            writer.writerow(
+                [strings[column[idx]] for column in columns]
+                + [self._errors.get(idx, ""), self._starts[idx], self._ends[idx]]
+            )
+
+    def write_xlsx(self, out):
+        """Write a one-sheet workbook to the binary stream out, the header row frozen."""
+        if len(self) + 1 > _XLSX_MAX_ROWS:
+            raise ValueError(f"{len(self)} rows do not fit in one worksheet")
+        letters = [_xlsx_column_letters(idx) for idx in range(len(self.keys) + 3)]
+        columns = list(self._columns.values())
+        error_column, start_column, end_column = letters[len(columns):]
+
+        # The sheet XML is highly repetitive, so fast deflate loses little size
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as package:
+            for name, xml in _XLSX_STATIC_PARTS.items():
+                package.writestr(name, xml)
+
+            with package.open("xl/sharedStrings.xml", "w") as handle:
+                handle.write(
+                    f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<sst xmlns="{_XLSX_MAIN_NS}">'.encode()
+                )
+                for offset in range(0, len(self._strings), _XLSX_ROWS_PER_WRITE):
+                    chunk = self._strings[offset:offset + _XLSX_ROWS_PER_WRITE]
+                    handle.write("".join(f"<si>{_xlsx_text(value)}</si>" for value in chunk).encode())
+                handle.write(b"</sst>")
+
+            with package.open("xl/worksheets/sheet1.xml", "w") as handle:
+                header = "".join(
+                    f'<c r="{letter}1" t="inlineStr"><is>{_xlsx_text(label)}</is></c>'
+                    for letter, label in zip(letters, self.headers())
+                )
+                handle.write(
+                    f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{_XLSX_MAIN_NS}">'
+                    '<sheetViews><sheetView workbookViewId="0">'
+                    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                    f'</sheetView></sheetViews><sheetData><row r="1">{header}</row>'.encode()
+                )
+                lines = []
+                for idx in range(len(self)):
+                    r = idx + 2
+                    # Empty values are left out; their cells simply don't exist
+                    cells = [
+                        f'<c r="{letter}{r}" t="s"><v>{column[idx]}</v></c>'
+                        for letter, column in zip(letters, columns)
+                        if column[idx]
+                    ]
+                    error = self._errors.get(idx)
+                    if error:
+                        cells.append(f'<c r="{error_column}{r}" t="inlineStr"><is>{_xlsx_text(error)}</is></c>')
+                    cells.append(f'<c r="{start_column}{r}"><v>{self._starts[idx]}</v></c>')
+                    cells.append(f'<c r="{end_column}{r}"><v>{self._ends[idx]}</v></c>')
+                    lines.append(f'<row r="{r}">{"".join(cells)}</row>')
+                    if len(lines) >= _XLSX_ROWS_PER_WRITE:
+                        handle.write("".join(lines).encode())
+                        lines = []
+                handle.write(("".join(lines) + "</sheetData></worksheet>").encode())
+
+# --- Render Cache ---
+
+# Bump whenever a change to the rendering code alters output for the same inputs,
+# so stale cache entries (including the disk tier) are never served
+RENDER_ENGINE_VERSION = "2"
+
+def render_cache_key(kind, template_bytes, data, account_id="", images=(), options=()):
+    """Content hash of everything that determines a rendered document."""
+    if isinstance(template_bytes, (CompiledListingTemplate, CompiledKYCTemplate)):
+        template_digest = template_bytes.template_digest
+    else:
+        template_digest = hashlib.sha256(template_bytes).digest()
+    # KYC template labels are normalized with the rules' aliases
+    if isinstance(template_bytes, CompiledKYCTemplate):
+        rules = template_bytes.rules_fingerprint
+    else:
+        rules = active_kyc_rules().fingerprint if kind == "kyc" else ""
+    pieces = [
+        RENDER_ENGINE_VERSION.encode(),
+        kind.encode(),
+        template_digest,
+        rules.encode(),
+        json.dumps(data, sort_keys=True, ensure_ascii=False, default=str).encode(),
+        str(account_id or "").encode(),
+        repr(options).encode(),
+    ]
+    # hashlib reads buffers in place, so memoryview inputs aren't copied to be hashed
+    pieces.extend(hashlib.sha256(img).digest() for img in images or ())
+    digest = hashlib.sha256()
+    for piece in pieces:
+        # Length-prefix every piece so adjacent fields can't run into each other
+        digest.update(len(piece).to_bytes(8, "little"))
+        digest.update(piece)
+    return digest.hexdigest()
+
+class RenderCache:
+    """Rendered documents keyed by render_cache_key.
+
+    The memory tier is an LRU bounded by total bytes; with a directory, entries are
+    also written to disk and promoted back into memory on a disk hit. The disk tier
+    is bounded by max_disk_bytes, dropping the least recently used files first, and
+    disk errors only ever cost a miss.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, directory=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError:
+                self.directory = None
+
+    def get(self, key):
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return blob
+        blob = self._read_disk(key)
+        with self._lock:
+            if blob is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, blob)
+        return blob
+
+    def put(self, key, blob):
+        with self._lock:
+            self._remember(key, blob)
+        self._write_disk(key, blob)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remember(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = blob
+        self._size += len(blob)
+        while self._size > self.max_bytes:
+            _key, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f"{key}.docx")
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as handle:
+                blob = handle.read()
+        except OSError:
+            return None
+        try:
+            # Pruning goes by mtime, so a hit keeps the file alive
+            os.utime(path)
+        except OSError:
+            pass
+        return blob
+
+    def _write_disk(self, key, blob):
+        if not self.directory:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as handle:
+                handle.write(blob)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._prune_disk()
+
+    def _prune_disk(self):
+        """Delete the oldest files until the directory fits in max_disk_bytes."""
+        files = []
+        total = 0
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".docx"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        except OSError:
+            return
+        if total <= self.max_disk_bytes:
+            return
+        files.sort()
+        for _mtime, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.disk_evictions += 1
+
+render_cache = RenderCache()
+
+# --- Instrumentation ---
+
+class RenderTrace:
+    """Wall time per pipeline stage plus work counters.
+
+    Pass one as trace= to generate_listing_agreement or fill_kyc_document_logic;
+    as_dict() gives a plain structure for a metrics pipeline. Stages that run more
+    than once (or across several renders) accumulate.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def as_dict(self):
+        return {
+            "stages_ms": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            "total_ms": round(sum(self.stages.values()) * 1000, 3),
+            "counters": dict(self.counters),
+        }
+
+# Shared no-op context so untraced renders don't pay for a context manager per stage
+_NO_STAGE = contextlib.nullcontext()
+
+def _stage(trace, name):
+    return _NO_STAGE if trace is None else trace.stage(name)
+
+# --- Document Bundles ---
+
+BUNDLE_MANIFEST_NAME = "manifest.json"
+
+def _bundle_job_name(job, index):
+    if job.get("name"):
+        return job["name"]
+    data = job.get("data") or {}
+    if job.get("kind") == "kyc":
+        return f"KYC_{job.get('account_id') or 'Report'}.docx"
+    return f"{data.get('token') or data.get('company') or f'Listing_{index + 1}'}_Agreement.docx"
+
+def _unique_member_name(name, used):
+    if not name.lower().endswith(".docx"):
+        name += ".docx"
+    stem, candidate, n = name[:-5], name, 2
+    while candidate in used or candidate == BUNDLE_MANIFEST_NAME:
+        candidate = f"{stem} ({n}).docx"
+        n += 1
+    used.add(candidate)
+    return candidate
+
+def _render_bundle_job(job, templates, cache, trace):
+    kind = job.get("kind", "listing")
+    if kind not in ("listing", "kyc"):
+        raise ValueError(f"Unknown job kind: {kind}")
+    template = job.get("template") or templates.get(kind)
+    if template is None:
+        raise ValueError(f"No template for job kind: {kind}")
+    data = job.get("data") or {}
+    if kind == "listing":
+        if not isinstance(template, CompiledListingTemplate):
+            template = get_compiled_listing_template(template)
+        return generate_listing_agreement(template, data, cache=cache, trace=trace)
+    if not isinstance(template, CompiledKYCTemplate):
+        template = get_compiled_kyc_template(template)
+    return fill_kyc_document_logic(
+        template, data, job.get("account_id", ""), job.get("images") or [], cache=cache, trace=trace,
+    )
+
+def generate_document_bundle(jobs, templates, out=None, cache=None):
+    """Render a batch of listing agreements / KYC reports into one zip.
+
+    jobs is any iterable of dicts with "kind" ("listing" or "kyc"), "data" and
+    optionally "name", "account_id", "images" and "template"; templates maps a kind to
+    its template bytes. Each document is written to the zip as soon as it's rendered
+    and then dropped, so at most one rendered document is held at a time. A failed job
+    is recorded in the manifest instead of aborting the bundle.
+
+    Returns (zip_bytes, manifest), or (None, manifest) when writing to a file-like out.
+    """
+    target = io.BytesIO() if out is None else out
+    manifest = {"jobs": [], "ok": 0, "failed": 0}
+    started = time.perf_counter()
+    used = set()
+    # Rendered .docx files are already deflated, so store them as is
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_STORED) as bundle:
+        for index, job in enumerate(jobs):
+            name = _unique_member_name(_bundle_job_name(job, index), used)
+            trace = RenderTrace()
+            entry = {"index": index, "name": name, "kind": job.get("kind", "listing")}
+            job_started = time.perf_counter()
+            try:
+                blob = _render_bundle_job(job, templates, cache, trace)
+                with trace.stage("write_bundle"):
+                    bundle.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), blob)
+                entry.update(status="ok", bytes=len(blob), error=None)
+                manifest["ok"] += 1
+                del blob
+            except Exception as exc:
+                entry.update(status="error", bytes=0, error=f"{type(exc).__name__}: {exc}")
+                manifest["failed"] += 1
+            entry["ms"] = round((time.perf_counter() - job_started) * 1000, 3)
+            entry["stages_ms"] = trace.as_dict()["stages_ms"]
+            manifest["jobs"].append(entry)
+        manifest["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        bundle.writestr(
+            zipfile.ZipInfo(BUNDLE_MANIFEST_NAME, time.localtime()[:6]),
+            json.dumps(manifest, ensure_ascii=False, indent=2),
+            compress_type=zipfile.ZIP_DEFLATED,
+        )
+    return (target.getvalue() if out is None else None), manifest
+
+# --- Async API ---
+
+class RenderCancelled(Exception):
+    """Raised inside a render whose async caller has been cancelled."""
+
+class _CancellableTrace(RenderTrace):
+    """A RenderTrace that aborts the render at the next stage or counter once cancelled."""
+
+    def __init__(self, cancelled):
+        super().__init__()
+        self._cancelled = cancelled
+
+    def stage(self, name):
+        if self._cancelled.is_set():
+            raise RenderCancelled(name)
+        return super().stage(name)
+
+    def count(self, name, amount=1):
+        if self._cancelled.is_set():
+            raise RenderCancelled(name)
+        super().count(name, amount)
+
+def _generate_listing_warm(template_bytes, data, cache=None, use_cache=False, **kwargs):
+    # In a worker process use_cache selects that process's own render_cache, since
+    # neither the cache nor compiled templates can be pickled across
+    if use_cache:
+        cache = render_cache
+    return generate_listing_agreement(get_compiled_listing_template(template_bytes), data, cache=cache, **kwargs)
+
+def _fill_kyc_warm(template_bytes, data, account_id, images, cache=None, use_cache=False, **kwargs):
+    if use_cache:
+        cache = render_cache
+    return fill_kyc_document_logic(
+        get_compiled_kyc_template(template_bytes), data, account_id, images, cache=cache, **kwargs,
+    )
+
+class AsyncRenderer:
+    """asyncio front end for listing, KYC fill and KYC extraction.
+
+    executor is "thread" (the default; lxml and Pillow release the GIL for much of the
+    work), "process", or any concurrent.futures.Executor. Cancelling an awaiting task
+    drops work that hasn't started; on a thread pool a running render also stops at
+    its next stage boundary. In worker processes, the cache argument selects each
+    process's own render_cache and traces are not collected. Under Pyodide there are
+    no threads, so calls run inline.
+    """
+
+    def __init__(self, executor="thread", max_workers=None, cache=None):
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        self._owns_executor = isinstance(executor, str)
+        self.cache = cache
+        if sys.platform == "emscripten":
+            self._executor = None
+            self._owns_executor = False
+        elif executor == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="render")
+        elif executor == "process":
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        elif isinstance(executor, str):
+            raise ValueError(f"Unknown executor: {executor}")
+        else:
+            self._executor = executor
+        # Caches, traces and events can't be pickled, whoever created the pool
+        self._processes = isinstance(self._executor, ProcessPoolExecutor)
+
+    async def generate_listing_agreement(self, template_bytes, data, trace=None):
+        if isinstance(template_bytes, CompiledListingTemplate):
+            template_bytes = template_bytes.template_bytes
+        return await self._render(_generate_listing_warm, (template_bytes, data), {}, trace)
+
+    async def fill_kyc_document(self, template_bytes, data, account_id, images_bytes_list,
+                                image_dpi=KYC_IMAGE_DPI, image_quality=KYC_IMAGE_QUALITY, trace=None):
+        if isinstance(template_bytes, CompiledKYCTemplate):
+            template_bytes = template_bytes.template_bytes
+        return await self._render(
+            _fill_kyc_warm, (template_bytes, data, account_id, list(images_bytes_list)),
+            {"image_dpi": image_dpi, "image_quality": image_quality}, trace,
+        )
+
+    async def extract_kyc_fields(self, text):
+        return await self._submit(functools.partial(extract_kyc_fields, text))
+
+    async def _render(self, fn, args, kwargs, trace):
+        if self._processes:
+            kwargs["use_cache"] = self.cache is not None
+            return await self._submit(functools.partial(fn, *args, **kwargs))
+
+        cancelled = threading.Event()
+        local_trace = _CancellableTrace(cancelled)
+        call = functools.partial(fn, *args, cache=self.cache, trace=local_trace, **kwargs)
+        try:
+            return await self._submit(call)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        finally:
+            # A cancelled render may still be running and writing to local_trace
+            if trace is not None and not cancelled.is_set():
+                for name, seconds in local_trace.stages.items():
+                    trace.stages[name] = trace.stages.get(name, 0.0) + seconds
+                for name, amount in local_trace.counters.items():
+                    trace.count(name, amount)
+
+    async def _submit(self, call):
+        if self._executor is None:
+            return call()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def close(self, cancel_pending=True):
+        if self._owns_executor:
+            self._executor.shutdown(wait=True, cancel_futures=cancel_pending)
+
+    async def __aenter__(self):
+        return self
 
-    append_kyc_images(doc, images_bytes_list)
-    return document_to_bytes(doc)
+    async def __aexit__(self, *exc_info):
+        self.close()
 
@@ -0,0 +1,48 @@
+"""Download the pure-Python wheels logic.py needs into public/wheels/.
+
+pyodide.ts loads these wheels straight from the site with pyodide.loadPackage, so
+startup doesn't wait on micropip resolving python-docx against PyPI. lxml (and Pillow)
+come from the Pyodide distribution itself and are listed in bundle.json by name.
+
+    python scripts/build_pyodide_bundle.py
+
+Re-run after changing the pins below and commit the result.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WHEELS = os.path.join(HERE, "..", "public", "wheels")
+
+# Pure-Python requirements of python-docx, pinned so every deploy loads the same code
+PINNED_WHEELS = ["python-docx==1.2.0", "typing_extensions==4.15.0"]
+# Packages loaded from the Pyodide distribution matching the indexURL in pyodide.ts
+PYODIDE_PACKAGES = ["lxml"]
+
+def main():
+    os.makedirs(WHEELS, exist_ok=True)
+    for name in os.listdir(WHEELS):
+        if name.endswith(".whl"):
+            os.remove(os.path.join(WHEELS, name))
+    subprocess.run(
+        [sys.executable, "-m", "pip", "download", "--no-deps", "--only-binary=:all:",
+         "--dest", WHEELS, *PINNED_WHEELS],
+        check=True,
+    )
+    wheels = []
+    for name in sorted(os.listdir(WHEELS)):
+        if not name.endswith(".whl"):
+            continue
+        with open(os.path.join(WHEELS, name), "rb") as handle:
+            wheels.append({"file": name, "sha256": hashlib.sha256(handle.read()).hexdigest()})
+    with open(os.path.join(WHEELS, "bundle.json"), "w", encoding="utf-8") as handle:
+        json.dump({"pyodide_packages": PYODIDE_PACKAGES, "wheels": wheels}, handle, indent=2)
+        handle.write("\n")
+    print(f"Wrote {len(wheels)} wheels to {os.path.normpath(WHEELS)}")
+
+if __name__ == "__main__":
+    main()
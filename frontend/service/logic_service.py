@@ -0,0 +1,259 @@
+"""Local HTTP service around public/logic.py for bulk, server-side generation.
+
+Templates from public/templates are compiled once in every worker of a pre-forked
+process pool, so requests pay neither interpreter start-up nor template parsing.
+
+    python service/logic_service.py --port 8765 --workers 4
+    python service/logic_service.py --kyc-rules rules.xlsx --kyc-rules-cache .cache/rules
+
+Endpoints (JSON in, JSON or .docx out):
+
+    POST /listing       {"template": "Company.docx", "data": {...}}
+    POST /kyc           {"data": {...}, "account_id": "...", "images": ["<base64>", ...]}
+    POST /kyc/extract   {"text": "..."}
+    GET  /metrics       request counts, latencies, queue depth and rejections
+    GET  /healthz
+
+When more than --max-pending requests are queued or running, new ones get
+503 with Retry-After instead of piling up. Only listens on localhost by default.
+"""
+
+import argparse
+import base64
+import binascii
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PUBLIC = os.path.join(HERE, "..", "public")
+TEMPLATES = os.path.join(PUBLIC, "templates")
+sys.path.insert(0, PUBLIC)
+
+import logic  # noqa: E402
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+KYC_TEMPLATE = "KYC.docx"
+
+# --- Worker processes ---
+
+_templates = {}
+
+def _warm_worker(template_dir, rules_artifact=None):
+    """Pool initializer: compile every bundled template once per worker process."""
+    if rules_artifact is not None:
+        logic.use_kyc_rules(logic.KYCRules(rules_artifact))
+    for name in sorted(os.listdir(template_dir)):
+        if not name.endswith(".docx"):
+            continue
+        with open(os.path.join(template_dir, name), "rb") as handle:
+            blob = handle.read()
+        if name == KYC_TEMPLATE:
+            _templates[name] = logic.get_compiled_kyc_template(blob)
+        else:
+            _templates[name] = logic.get_compiled_listing_template(blob)
+
+def _template(name):
+    template = _templates.get(name)
+    if template is None:
+        raise KeyError(f"Unknown template: {name}")
+    return template
+
+def _run_job(kind, payload):
+    if kind == "listing":
+        template = _template(payload.get("template", "Company.docx"))
+        return logic.generate_listing_agreement(template, payload.get("data") or {}, cache=logic.render_cache)
+    if kind == "kyc":
+        from docx.image.exceptions import UnrecognizedImageError
+
+        try:
+            images = [base64.b64decode(img, validate=True) for img in payload.get("images") or []]
+        except (binascii.Error, TypeError) as exc:
+            raise ValueError(f"Invalid base64 image: {exc}") from None
+        try:
+            return logic.fill_kyc_document_logic(
+                _template(KYC_TEMPLATE), payload.get("data") or {}, payload.get("account_id", ""), images,
+                cache=logic.render_cache,
+            )
+        except UnrecognizedImageError:
+            # Reported as a bad request, like any other invalid payload
+            raise ValueError("Unrecognized image format") from None
+    if kind == "extract":
+        return logic.extract_kyc_fields(payload.get("text", ""))
+    raise ValueError(f"Unknown job kind: {kind}")
+
+# --- Metrics ---
+
+class ServiceMetrics:
+    """Per-endpoint request counts and latencies, plus queue depth and rejections."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.pending = 0
+        self.rejected = 0
+        self.endpoints = {}
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            entry = self.endpoints.setdefault(
+                endpoint, {"requests": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "statuses": {}},
+            )
+            entry["requests"] += 1
+            entry["errors"] += status >= 400
+            entry["total_ms"] += seconds * 1000
+            entry["max_ms"] = max(entry["max_ms"], seconds * 1000)
+            entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {
+                name: dict(entry, mean_ms=round(entry["total_ms"] / entry["requests"], 3))
+                for name, entry in self.endpoints.items()
+            }
+            return {
+                "uptime_s": round(time.time() - self.started, 3),
+                "pending": self.pending,
+                "rejected": self.rejected,
+                "endpoints": endpoints,
+            }
+
+# --- HTTP ---
+
+_ROUTES = {"/listing": "listing", "/kyc": "kyc", "/kyc/extract": "extract"}
+
+# Types of the payload fields each job reads; data and images may also be null
+_FIELD_TYPES = {
+    "listing": {"template": (str,), "data": (dict, type(None))},
+    "kyc": {"data": (dict, type(None)), "account_id": (str,), "images": (list, type(None))},
+    "extract": {"text": (str,)},
+}
+
+def _check_payload(kind, payload):
+    """Raise ValueError unless payload is an object whose fields have the types _run_job expects."""
+    if not isinstance(payload, dict):
+        raise ValueError("Request body must be a JSON object")
+    for field, types in _FIELD_TYPES[kind].items():
+        if field in payload and not isinstance(payload[field], types):
+            raise ValueError(f"Invalid {field!r}: expected {' or '.join(t.__name__ for t in types)}")
+    if not all(isinstance(image, str) for image in payload.get("images") or []):
+        raise ValueError("Invalid 'images': expected base64 strings")
+
+class LogicService(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, max_pending=32, template_dir=TEMPLATES, kyc_rules=None):
+        super().__init__(address, _Handler)
+        self.metrics = ServiceMetrics()
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.workers = workers or os.cpu_count() or 1
+        # Rules are compiled here once and handed to every worker as their artifact
+        artifact = kyc_rules.artifact if kyc_rules is not None else None
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_warm_worker, initargs=(template_dir, artifact),
+        )
+        # Start every worker now so the first requests don't pay for forking and warming
+        for future in [self.pool.submit(_run_job, "extract", {}) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, kind, payload):
+        """Run a job on the pool, or return None when the service is at capacity."""
+        if not self._slots.acquire(blocking=False):
+            with self.metrics._lock:
+                self.metrics.rejected += 1
+            return None
+        with self.metrics._lock:
+            self.metrics.pending += 1
+        try:
+            return self.pool.submit(_run_job, kind, payload).result()
+        finally:
+            with self.metrics._lock:
+                self.metrics.pending -= 1
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        started = time.perf_counter()
+        if self.path == "/metrics":
+            status = self._send_json(200, self.server.metrics.snapshot())
+        elif self.path == "/healthz":
+            status = self._send_json(200, {"ok": True})
+        else:
+            status = self._send_json(404, {"error": "Not found"})
+        self.server.metrics.record(self.path if status != 404 else "other", status, time.perf_counter() - started)
+
+    def do_POST(self):
+        started = time.perf_counter()
+        kind = _ROUTES.get(self.path)
+        try:
+            # Read the body even for unknown paths, or it would be parsed as the next request
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if kind is None:
+                status = self._send_json(404, {"error": "Not found"})
+            else:
+                payload = json.loads(body or b"{}")
+                _check_payload(kind, payload)
+                result = self.server.submit(kind, payload)
+                if result is None:
+                    status = self._send_json(503, {"error": "Busy, retry later"}, {"Retry-After": "1"})
+                elif kind == "extract":
+                    status = self._send_json(200, {"fields": result})
+                else:
+                    status = self._send(200, result, DOCX_MIME)
+        except (ValueError, KeyError) as exc:
+            status = self._send_json(400, {"error": f"{type(exc).__name__}: {exc}"})
+        except Exception as exc:
+            status = self._send_json(500, {"error": f"{type(exc).__name__}: {exc}"})
+        self.server.metrics.record(self.path if kind else "other", status, time.perf_counter() - started)
+
+    def _send_json(self, status, body, headers=None):
+        return self._send(status, json.dumps(body, ensure_ascii=False).encode(), "application/json", headers)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def log_message(self, format, *args):
+        pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--max-pending", type=int, default=32, help="queued + running requests before 503")
+    parser.add_argument("--kyc-rules", metavar="PATH", help="KYC label rule file (.xlsx or .json)")
+    parser.add_argument("--kyc-rules-cache", metavar="DIR", help="directory for compiled rule artifacts")
+    args = parser.parse_args(argv)
+
+    kyc_rules = logic.load_kyc_rules(args.kyc_rules, cache_dir=args.kyc_rules_cache) if args.kyc_rules else None
+    server = LogicService(
+        (args.host, args.port), workers=args.workers, max_pending=args.max_pending, kyc_rules=kyc_rules,
+    )
+    print(f"Serving on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
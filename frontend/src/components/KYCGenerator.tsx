@@ -85,7 +85,8 @@ export const KYCGenerator: React.FC = () => {
             }
 
             const { runKYCGeneration } = await import('../lib/pyodide');
-            const resultBytes = await runKYCGeneration(templateBytes, data, accountId, imageBytesList);
+            // The image buffers were read just for this call, so hand them to the worker
+            const resultBytes = await runKYCGeneration(templateBytes, data, accountId, imageBytesList, { transferImages: true });
 
             const blob = new Blob([resultBytes as unknown as BlobPart], { type: "application/vnd.openxmlformats-officedocument.wordprocessingml.document" });
             saveAs(blob, `KYC_${accountId || "Report"}.docx`);
@@ -1,76 +1,175 @@
-declare global {
-    interface Window {
-        loadPyodide: any;
+// Pyodide runs in Web Workers so long renders never block the UI. Extraction and
+// document rendering get separate workers, so extraction stays responsive while a
+// large KYC report is being built.
+
+type WorkerRole = "extract" | "render";
+
+interface PendingCall {
+    resolve: (value: any) => void;
+    reject: (reason: any) => void;
+}
+
+const workers = new Map<WorkerRole, Worker>();
+const pending = new Map<number, PendingCall>();
+let nextCallId = 1;
+
+function getWorker(role: WorkerRole): Worker {
+    let worker = workers.get(role);
+    if (!worker) {
+        worker = new Worker(new URL("./pyodide.worker.ts", import.meta.url), { type: "module", name: `pyodide-${role}` });
+        worker.onmessage = (event: MessageEvent) => {
+            const { id, result, error, cancelled } = event.data;
+            const call = pending.get(id);
+            if (!call) return;
+            pending.delete(id);
+            if (cancelled) call.reject(new DOMException("Aborted", "AbortError"));
+            else if (error !== undefined) call.reject(new Error(error));
+            else call.resolve(result);
+        };
+        workers.set(role, worker);
+    }
+    return worker;
+}
+
+function callWorker<T>(
+    role: WorkerRole, op: string, args: any[], signal?: AbortSignal, transfer: Transferable[] = [],
+): Promise<T> {
+    if (signal?.aborted) {
+        return Promise.reject(new DOMException("Aborted", "AbortError"));
     }
+    const worker = getWorker(role);
+    const id = nextCallId++;
+    return new Promise<T>((resolve, reject) => {
+        pending.set(id, { resolve, reject });
+        signal?.addEventListener("abort", () => {
+            if (!pending.has(id)) return;
+            pending.delete(id);
+            // Drops the call if it hasn't started; a running render finishes and is discarded
+            worker.postMessage({ type: "cancel", id });
+            reject(new DOMException("Aborted", "AbortError"));
+        }, { once: true });
+        worker.postMessage({ type: "call", id, op, args }, transfer);
+    });
+}
+
+// Starts Pyodide for extraction right away and warms the render worker's docx packages
+export async function initPyodide(): Promise<void> {
+    callWorker<null>("render", "init", [true]).catch(() => {});
+    await callWorker<null>("extract", "init", [false]);
 }
 
-let pyodide: any = null;
+export function runListingGeneration(templateBytes: Uint8Array, data: any, signal?: AbortSignal): Promise<Uint8Array> {
+    return callWorker("render", "listing", [templateBytes, data], signal);
+}
 
-export async function initPyodide() {
-    if (pyodide) return pyodide;
+// Renders for a live preview; successive calls with the same template only redo what changed
+export function runListingPreview(templateBytes: Uint8Array, data: any, signal?: AbortSignal): Promise<Uint8Array> {
+    return callWorker("render", "listingPreview", [templateBytes, data], signal);
+}
+
+export interface PreviewRun {
+    text: string;
+    bold: boolean;
+    italic: boolean;
+    underline: boolean;
+}
 
-    if (!window.loadPyodide) {
-        throw new Error("Pyodide script not loaded");
+export type PreviewBlock =
+    | {
+        type: "paragraph";
+        text: string;
+        style: string | null;
+        align: string | null;
+        runs: PreviewRun[];
+        // Relationship ids of pictures already in the template
+        images: string[];
     }
+    | { type: "table"; rows: PreviewBlock[][][] }
+    // ref indexes the images passed in; duplicates are listed once
+    | { type: "image"; ref: number; sha256: string };
 
-    pyodide = await window.loadPyodide({
-        indexURL: "https://cdn.jsdelivr.net/pyodide/v0.23.4/full/"
-    });
+// Filled text only, cheap enough to call on every keystroke
+export function runListingTextPreview(templateBytes: Uint8Array, data: any, signal?: AbortSignal): Promise<PreviewBlock[]> {
+    return callWorker("render", "listingText", [templateBytes, data], signal);
+}
 
-    await pyodide.loadPackage("micropip");
-    const micropip = pyodide.pyimport("micropip");
+export function runKYCTextPreview(
+    templateBytes: Uint8Array, data: any, accountId: string, images: Uint8Array[], signal?: AbortSignal,
+): Promise<PreviewBlock[]> {
+    return callWorker("render", "kycText", [templateBytes, data, accountId, images], signal);
+}
 
-    // Install python-docx and its dependencies
-    await micropip.install("python-docx");
+export interface KYCGenerationOptions {
+    signal?: AbortSignal;
+    // Move the image buffers to the worker instead of cloning them; they are
+    // detached (empty) in the caller afterwards
+    transferImages?: boolean;
+}
 
-    // Load our logic script
-    const response = await fetch("/logic.py");
-    const script = await response.text();
-    await pyodide.runPythonAsync(script);
+export function runKYCGeneration(
+    templateBytes: Uint8Array, data: any, accountId: string, images: Uint8Array[], options: KYCGenerationOptions = {},
+): Promise<Uint8Array> {
+    const transfer = options.transferImages ? images.map((image) => image.buffer) : [];
+    return callWorker("render", "kyc", [templateBytes, data, accountId, images], options.signal, transfer);
+}
 
-    return pyodide;
+export function getRenderCacheStats(): Promise<Record<string, number>> {
+    return callWorker("render", "cacheStats", []);
 }
 
-export async function runListingGeneration(templateBytes: Uint8Array, data: any): Promise<Uint8Array> {
-    const p = await initPyodide();
-    p.globals.set("template_bytes", templateBytes);
-    p.globals.set("data_json", data);
+export function runKYCExtraction(text: string, signal?: AbortSignal): Promise<any> {
+    return callWorker("extract", "extract", [text], signal);
+}
 
-    const result = await p.runPythonAsync(`
-        import js
-        data = data_json.to_py()
-        generate_listing_agreement(template_bytes, data)
-    `);
+// Re-extracts only the edited lines; the session lives in the extraction worker between calls
+export function runKYCExtractionIncremental(text: string, signal?: AbortSignal): Promise<Record<string, string>> {
+    return callWorker("extract", "extractIncremental", [text], signal);
+}
 
-    return result.toJs();
+export interface KYCBatchRecord {
+    fields: Record<string, string>;
+    error: string | null;
 }
 
-export async function runKYCGeneration(templateBytes: Uint8Array, data: any, accountId: string, images: Uint8Array[]): Promise<Uint8Array> {
-    const p = await initPyodide();
+export function runKYCExtractionBatch(texts: string[], signal?: AbortSignal): Promise<KYCBatchRecord[]> {
+    return callWorker("extract", "extractBatch", [texts], signal);
+}
+
+// Bulk extraction straight to a review spreadsheet, one row per email
+export function runKYCExtractionExport(texts: string[], format: "csv" | "xlsx", signal?: AbortSignal): Promise<Uint8Array> {
+    return callWorker("extract", "extractExport", [texts, format], signal);
+}
 
-    p.globals.set("template_bytes", templateBytes);
-    p.globals.set("data_json", data);
-    p.globals.set("account_id", accountId);
-    p.globals.set("images_list", images);
+export interface BundleJob {
+    kind: "listing" | "kyc";
+    data: any;
+    name?: string;
+    accountId?: string;
+    images?: Uint8Array[];
+}
 
-    const result = await p.runPythonAsync(`
-        data = data_json.to_py()
-        imgs = [bytes(x) for x in images_list]
-        fill_kyc_document_logic(template_bytes, data, account_id, imgs)
-    `);
+export interface BundleManifestEntry {
+    index: number;
+    name: string;
+    kind: string;
+    status: "ok" | "error";
+    bytes: number;
+    error: string | null;
+    ms: number;
+    stages_ms: Record<string, number>;
+}
 
-    return result.toJs();
+export interface BundleManifest {
+    jobs: BundleManifestEntry[];
+    ok: number;
+    failed: number;
+    total_ms: number;
 }
 
-export async function runKYCExtraction(text: string): Promise<any> {
-    const p = await initPyodide();
-    p.globals.set("email_text", text);
-    const result = await p.runPythonAsync(`
-        extract_kyc_fields(email_text)
-    `);
-    const jsResult = result.toJs();
-    if (jsResult instanceof Map) {
-        return Object.fromEntries(jsResult.entries());
-    }
-    return jsResult;
+export function runDocumentBundle(
+    jobs: BundleJob[],
+    templates: { listing?: Uint8Array; kyc?: Uint8Array },
+    signal?: AbortSignal,
+): Promise<{ zip: Uint8Array; manifest: BundleManifest }> {
+    return callWorker("render", "bundle", [jobs, templates], signal);
 }
@@ -0,0 +1,311 @@
+/// <reference lib="webworker" />
+// Hosts Pyodide and logic.py off the main thread; pyodide.ts talks to it by message.
+
+const PYODIDE_URL = "https://cdn.jsdelivr.net/pyodide/v0.23.4/full/";
+
+let pyodideReady: Promise<any> | null = null;
+let docxReady: Promise<void> | null = null;
+
+// Loads Pyodide and logic.py only; KYC text extraction needs nothing else
+function initPyodide(): Promise<any> {
+    if (!pyodideReady) {
+        pyodideReady = loadLogic().catch((error) => {
+            pyodideReady = null;
+            throw error;
+        });
+    }
+    return pyodideReady;
+}
+
+async function loadLogic() {
+    const [{ loadPyodide }, script] = await Promise.all([
+        import(/* @vite-ignore */ `${PYODIDE_URL}pyodide.mjs`),
+        fetch("/logic.py").then((response) => response.text()),
+    ]);
+    const pyodide = await loadPyodide({ indexURL: PYODIDE_URL });
+
+    // Load our logic script; python-docx and lxml are imported lazily inside it
+    await pyodide.runPythonAsync(script);
+    return pyodide;
+}
+
+function ensureDocxPackages(p: any): Promise<void> {
+    if (!docxReady) {
+        docxReady = installDocxPackages(p).catch((error) => {
+            docxReady = null;
+            throw error;
+        });
+    }
+    return docxReady;
+}
+
+async function installDocxPackages(p: any) {
+    // Prefer the prebuilt wheels shipped with the site (scripts/build_pyodide_bundle.py)
+    const response = await fetch("/wheels/bundle.json").catch(() => null);
+    if (response && response.ok) {
+        const bundle = await response.json();
+        const wheels = bundle.wheels.map((wheel: { file: string }) => new URL(`/wheels/${wheel.file}`, self.location.origin).href);
+        await p.loadPackage([...bundle.pyodide_packages, ...wheels]);
+        return;
+    }
+
+    await p.loadPackage("micropip");
+    const micropip = p.pyimport("micropip");
+
+    // Install python-docx and its dependencies
+    await micropip.install("python-docx");
+}
+
+// Pyodide plus python-docx/lxml, for anything that reads or writes .docx files
+async function initDocx() {
+    const p = await initPyodide();
+    await ensureDocxPackages(p);
+    return p;
+}
+
+// Copies a Python bytes result out once and releases everything the call pinned, so
+// neither the Python result nor the JS inputs outlive the call
+function takeBytes(p: any, result: any, globals: string[]): Uint8Array {
+    try {
+        return result.toJs();
+    } finally {
+        result.destroy();
+        for (const name of globals) {
+            p.globals.delete(name);
+        }
+    }
+}
+
+function takeBlocks(p: any, result: any, globals: string[]): any[] {
+    try {
+        return result.toJs({ dict_converter: Object.fromEntries });
+    } finally {
+        result.destroy();
+        for (const name of globals) {
+            p.globals.delete(name);
+        }
+    }
+}
+
+const ops: Record<string, (...args: any[]) => Promise<any>> = {
+    async init(withDocx: boolean) {
+        await (withDocx ? initDocx() : initPyodide());
+        return null;
+    },
+
+    async listing(templateBytes: Uint8Array, data: any) {
+        const p = await initDocx();
+        p.globals.set("template_bytes", templateBytes);
+        p.globals.set("data_json", data);
+
+        const result = await p.runPythonAsync(`
+            data = data_json.to_py()
+            generate_listing_agreement(get_compiled_listing_template(template_bytes), data, cache=render_cache)
+        `);
+        return takeBytes(p, result, ["template_bytes", "data_json"]);
+    },
+
+    // Live preview: the session keeps the parsed agreement between calls and
+    // re-renders only what changed since the previous data
+    async listingPreview(templateBytes: Uint8Array, data: any) {
+        const p = await initDocx();
+        p.globals.set("template_bytes", templateBytes);
+        p.globals.set("data_json", data);
+
+        const result = await p.runPythonAsync(`
+            get_listing_preview_session(template_bytes).update(data_json.to_py())
+        `);
+        return takeBytes(p, result, ["template_bytes", "data_json"]);
+    },
+
+    // Filled text as paragraph/table blocks for on-screen review; no .docx is written
+    async listingText(templateBytes: Uint8Array, data: any) {
+        const p = await initDocx();
+        p.globals.set("template_bytes", templateBytes);
+        p.globals.set("data_json", data);
+
+        const result = await p.runPythonAsync(`
+            get_listing_preview_session(template_bytes).preview(data_json.to_py())
+        `);
+        return takeBlocks(p, result, ["template_bytes", "data_json"]);
+    },
+
+    // Images are only hashed, so Pillow is never needed here
+    async kycText(templateBytes: Uint8Array, data: any, accountId: string, images: Uint8Array[]) {
+        const p = await initDocx();
+        p.globals.set("template_bytes", templateBytes);
+        p.globals.set("data_json", data);
+        p.globals.set("account_id", accountId);
+        p.globals.set("images_list", images);
+
+        const result = await p.runPythonAsync(`
+            preview_kyc_document(
+                get_compiled_kyc_template(template_bytes), data_json.to_py(), account_id, images_list.to_py(),
+            )
+        `);
+        return takeBlocks(p, result, ["template_bytes", "data_json", "account_id", "images_list"]);
+    },
+
+    async kyc(templateBytes: Uint8Array, data: any, accountId: string, images: Uint8Array[]) {
+        const p = await initDocx();
+        // Pillow is only needed to downscale KYC photos, so load it on first use
+        if (images.length > 0) {
+            await p.loadPackage("Pillow");
+        }
+
+        p.globals.set("template_bytes", templateBytes);
+        p.globals.set("data_json", data);
+        p.globals.set("account_id", accountId);
+        p.globals.set("images_list", images);
+
+        // Images are copied into Python one at a time as the writer asks for them, so
+        // only the current photo is held on the Python heap. The render cache would have
+        // to hash every image up front, so this op doesn't use it.
+        const result = await p.runPythonAsync(`
+            fill_kyc_document_streaming(
+                template_bytes, data_json.to_py(), account_id, (image.to_py() for image in images_list),
+            )
+        `);
+        return takeBytes(p, result, ["template_bytes", "data_json", "account_id", "images_list"]);
+    },
+
+    async cacheStats() {
+        const p = await initPyodide();
+        const result = await p.runPythonAsync(`render_cache.stats()`);
+        const stats = result.toJs({ dict_converter: Object.fromEntries });
+        result.destroy();
+        return stats;
+    },
+
+    async extract(text: string) {
+        const p = await initPyodide();
+        p.globals.set("email_text", text);
+        const result = await p.runPythonAsync(`
+            extract_kyc_fields(email_text)
+        `);
+        const fields = result.toJs({ dict_converter: Object.fromEntries });
+        result.destroy();
+        return fields;
+    },
+
+    // Re-extracts only the edited lines; the session lives in the Python globals between calls
+    async extractIncremental(text: string) {
+        const p = await initPyodide();
+        p.globals.set("email_text", text);
+        const result = await p.runPythonAsync(`
+            if "kyc_extraction_session" not in globals():
+                kyc_extraction_session = KYCExtractionSession()
+            kyc_extraction_session.set_text(email_text)
+        `);
+        const fields = result.toJs({ dict_converter: Object.fromEntries });
+        result.destroy();
+        return fields;
+    },
+
+    async extractBatch(texts: string[]) {
+        const p = await initPyodide();
+        p.globals.set("email_texts", texts);
+        const result = await p.runPythonAsync(`
+            [
+                {"fields": fields, "error": error}
+                for _index, fields, error in extract_kyc_fields_batch(email_texts.to_py())
+            ]
+        `);
+        const records = result.toJs({ dict_converter: Object.fromEntries });
+        result.destroy();
+        return records;
+    },
+
+    // Extracts every email into a KYCResultStore and returns the review sheet as one file
+    async extractExport(texts: string[], format: "csv" | "xlsx") {
+        const p = await initPyodide();
+        p.globals.set("email_texts", texts);
+        p.globals.set("export_format", format);
+        const result = await p.runPythonAsync(`
+            def _export_kyc(texts, export_format):
+                store = KYCResultStore.from_texts(texts)
+                buffer = io.BytesIO()
+                if export_format == "csv":
+                    text = io.TextIOWrapper(buffer, encoding="utf-8-sig", newline="")
+                    store.write_csv(text)
+                    text.flush()
+                    text.detach()
+                else:
+                    store.write_xlsx(buffer)
+                return buffer.getvalue()
+
+            _export_kyc(email_texts.to_py(), export_format)
+        `);
+        return takeBytes(p, result, ["email_texts", "export_format"]);
+    },
+
+    async bundle(jobs: any[], templates: Record<string, Uint8Array>) {
+        const p = await initDocx();
+        if (jobs.some((job) => job.kind === "kyc" && job.images && job.images.length > 0)) {
+            await p.loadPackage("Pillow");
+        }
+        p.globals.set("bundle_jobs", jobs);
+        p.globals.set("bundle_templates", templates);
+
+        const result = await p.runPythonAsync(`
+            def _bundle_jobs(js_jobs):
+                # Convert one job at a time so only the current job's images are copied into Python
+                for js_job in js_jobs:
+                    yield {
+                        "kind": js_job.kind,
+                        "data": js_job.data.to_py() if js_job.data else {},
+                        "name": getattr(js_job, "name", None),
+                        "account_id": getattr(js_job, "accountId", "") or "",
+                        "images": [x.to_py() for x in (getattr(js_job, "images", None) or [])],
+                    }
+
+            # No render cache: it would keep a copy of every bundled document alive
+            generate_document_bundle(
+                _bundle_jobs(bundle_jobs),
+                {kind: bytes(blob) for kind, blob in bundle_templates.to_py().items() if blob is not None},
+            )
+        `);
+        const [zip, manifest] = result.toJs({ dict_converter: Object.fromEntries });
+        result.destroy();
+        return { zip, manifest };
+    },
+};
+
+interface WorkerRequest {
+    type: "call" | "cancel";
+    id: number;
+    op?: string;
+    args?: any[];
+}
+
+const cancelled = new Set<number>();
+// One interpreter per worker, so calls run one at a time in arrival order
+let queue: Promise<void> = Promise.resolve();
+
+self.onmessage = (event: MessageEvent<WorkerRequest>) => {
+    const request = event.data;
+    if (request.type === "cancel") {
+        cancelled.add(request.id);
+        return;
+    }
+    queue = queue.then(() => handle(request));
+};
+
+async function handle({ id, op, args }: WorkerRequest) {
+    // Cancelled before it started; Python that is already running can't be interrupted
+    if (cancelled.delete(id)) {
+        self.postMessage({ id, cancelled: true });
+        return;
+    }
+    try {
+        const result = await ops[op!](...(args || []));
+        const transfer: Transferable[] = [];
+        if (result instanceof Uint8Array) transfer.push(result.buffer);
+        if (result && result.zip instanceof Uint8Array) transfer.push(result.zip.buffer);
+        self.postMessage({ id, result }, transfer);
+    } catch (error) {
+        self.postMessage({ id, error: error instanceof Error ? error.message : String(error) });
+    } finally {
+        cancelled.delete(id);
+    }
+}
@@ -0,0 +1,39 @@
+import io
+import os
+import sys
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PUBLIC = os.path.join(HERE, "..", "public")
+TEMPLATES = os.path.join(PUBLIC, "templates")
+sys.path.insert(0, PUBLIC)
+
+# Form data covering the Technical Fee and wallet clause variants and awkward values
+LISTING_DATA_SETS = [
+    dict(
+        company="ACME Ltd", signdate="2026-01-02", listingdate="2026-02-03", signname="Jane Roe", token="ACM",
+        amount="10,000", amountInWords="TEN THOUSAND", jurisdiction="Cayman",
+        wallets={"erc20": "0xabc", "trc20": "Txyz"}, walletText="",
+    ),
+    dict(company="B&B <Co>", token="BB", amount="5", amountInWords="FIVE", wallets={}, walletText="",
+         includeTechnicalFee=False),
+    dict(company="C", token="C", amount="1", amountInWords="ONE", wallets={"bsc": "0x1"},
+         walletText="Custom line 1\nCustom line 2", includeTechnicalFee=True, Jurisdiction="BVI"),
+    dict(company="Co {x} {{", token="T$1\\g<0>", amount=None, wallets={}, walletText="",
+         includeTechnicalFee=False),
+]
+
+
+def read_template(name):
+    with open(os.path.join(TEMPLATES, name), "rb") as handle:
+        return handle.read()
+
+
+def story_xml(blob):
+    """The document, header and footer XML of a .docx, which renders must reproduce exactly."""
+    archive = zipfile.ZipFile(io.BytesIO(blob))
+    return {
+        name: archive.read(name)
+        for name in archive.namelist()
+        if name == "word/document.xml" or name.startswith(("word/header", "word/footer"))
+    }
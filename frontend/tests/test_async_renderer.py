@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+import logic
+from conftest import LISTING_DATA_SETS, read_template, story_xml
+
+
+@pytest.mark.parametrize("make_executor", [
+    lambda: "thread",
+    lambda: ThreadPoolExecutor(max_workers=2),
+    lambda: ProcessPoolExecutor(max_workers=1),
+], ids=["thread", "user thread pool", "user process pool"])
+def test_renders_match_the_synchronous_api(make_executor):
+    template = read_template("Company.docx")
+    executor = make_executor()
+
+    async def main():
+        async with logic.AsyncRenderer(executor, cache=logic.RenderCache()) as renderer:
+            return await asyncio.gather(*[
+                renderer.generate_listing_agreement(template, data) for data in LISTING_DATA_SETS
+            ])
+
+    try:
+        rendered = asyncio.run(main())
+    finally:
+        if not isinstance(executor, str):
+            executor.shutdown()
+    expected = [logic.generate_listing_agreement(template, data) for data in LISTING_DATA_SETS]
+    assert [story_xml(blob) for blob in rendered] == [story_xml(blob) for blob in expected]
+
+
+def test_traces_are_merged_into_the_callers():
+    template = read_template("Company.docx")
+    trace = logic.RenderTrace()
+
+    async def main():
+        async with logic.AsyncRenderer() as renderer:
+            await renderer.generate_listing_agreement(template, LISTING_DATA_SETS[0], trace=trace)
+
+    asyncio.run(main())
+    assert "replace_placeholders" in trace.stages
+    assert trace.counters["placeholders_replaced"] > 0
+
+
+def test_cancel_stops_a_running_render(monkeypatch):
+    started = threading.Event()
+    resume = threading.Event()
+    outcome = []
+    render = logic.generate_listing_agreement
+
+    def blocked_render(template_bytes, data, trace=None, **kwargs):
+        trace.count("started")
+        started.set()
+        resume.wait(5)
+        try:
+            return render(template_bytes, data, trace=trace, **kwargs)
+        except BaseException as exc:
+            outcome.append(exc)
+            raise
+        finally:
+            # Keeps writing to its trace after the caller has given up
+            for idx in range(100):
+                trace.counters[f"late_{idx}"] = idx
+
+    monkeypatch.setattr(logic, "generate_listing_agreement", blocked_render)
+    template = read_template("Company.docx")
+    trace = logic.RenderTrace()
+
+    async def main():
+        async with logic.AsyncRenderer(max_workers=1) as renderer:
+            task = asyncio.ensure_future(
+                renderer.generate_listing_agreement(template, LISTING_DATA_SETS[0], trace=trace)
+            )
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            resume.set()
+
+    asyncio.run(main())
+    assert len(outcome) == 1 and isinstance(outcome[0], logic.RenderCancelled)
+    assert trace.stages == {} and trace.counters == {}
+
+
+def test_cancel_drops_a_queued_render():
+    template = read_template("Company.docx")
+    pool = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    pool.submit(release.wait, 5)
+
+    async def main():
+        renderer = logic.AsyncRenderer(pool)
+        task = asyncio.ensure_future(renderer.generate_listing_agreement(template, LISTING_DATA_SETS[0]))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        release.set()
+
+    asyncio.run(main())
+    pool.shutdown(wait=True)
@@ -0,0 +1,52 @@
+import io
+import json
+import zipfile
+
+from PIL import Image
+
+import logic
+from conftest import LISTING_DATA_SETS, read_template, story_xml
+
+
+def _png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 30), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_bundle_members_match_single_renders():
+    templates = {"listing": read_template("Company.docx"), "kyc": read_template("KYC.docx")}
+    images = [_png("red"), _png("blue")]
+    kyc_data = {"name": "Jane Roe", "country": "China"}
+    jobs = [
+        {"kind": "listing", "data": LISTING_DATA_SETS[0]},
+        {"kind": "listing", "data": LISTING_DATA_SETS[0]},
+        {"kind": "kyc", "data": kyc_data, "account_id": "10001", "images": images},
+        {"kind": "kyc", "data": kyc_data, "account_id": "10002", "images": [b"not an image"]},
+        {"kind": "unknown", "name": "manifest.json"},
+        {"kind": "listing", "data": LISTING_DATA_SETS[1], "name": "custom"},
+    ]
+
+    blob, manifest = logic.generate_document_bundle(iter(jobs), templates)
+
+    names = ["ACM_Agreement.docx", "ACM_Agreement (2).docx", "KYC_10001.docx", "custom.docx"]
+    with zipfile.ZipFile(io.BytesIO(blob)) as bundle:
+        assert bundle.namelist() == names + [logic.BUNDLE_MANIFEST_NAME]
+        members = {name: bundle.read(name) for name in names}
+        assert json.loads(bundle.read(logic.BUNDLE_MANIFEST_NAME)) == manifest
+
+    listing = logic.generate_listing_agreement(templates["listing"], LISTING_DATA_SETS[0])
+    assert story_xml(members["ACM_Agreement.docx"]) == story_xml(listing)
+    assert story_xml(members["ACM_Agreement (2).docx"]) == story_xml(listing)
+    kyc = logic.fill_kyc_document_logic(templates["kyc"], kyc_data, "10001", images)
+    with zipfile.ZipFile(io.BytesIO(members["KYC_10001.docx"])) as rendered, zipfile.ZipFile(io.BytesIO(kyc)) as single:
+        assert rendered.namelist() == single.namelist()
+        assert all(rendered.read(name) == single.read(name) for name in single.namelist())
+    custom = logic.generate_listing_agreement(templates["listing"], LISTING_DATA_SETS[1])
+    assert story_xml(members["custom.docx"]) == story_xml(custom)
+
+    # Failed jobs are reported in the manifest and don't stop the bundle
+    assert [job["status"] for job in manifest["jobs"]] == ["ok", "ok", "ok", "error", "error", "ok"]
+    assert manifest["ok"] == 4 and manifest["failed"] == 2
+    assert manifest["jobs"][3]["error"].startswith("UnrecognizedImageError")
+    assert manifest["jobs"][4]["error"] == "ValueError: Unknown job kind: unknown"
@@ -0,0 +1,26 @@
+import pytest
+
+import logic
+
+TEXTS = [
+    "Name: John\nCountry: China",
+    None,
+    "Submit IP: 1.2.3.4\nDevice ID: ID: abc",
+    "",
+    5,
+    "姓名: 张三\n国家: 中国\n证件号码: E1234567",
+] * 5
+
+
+@pytest.mark.parametrize("max_workers, chunk_size", [(None, 64), (2, 4)], ids=["inline", "process pool"])
+def test_batch_matches_single_extraction(max_workers, chunk_size):
+    records = list(logic.extract_kyc_fields_batch(iter(TEXTS), max_workers=max_workers, chunk_size=chunk_size))
+
+    assert [index for index, _fields, _error in records] == list(range(len(TEXTS)))
+    for (_index, fields, error), text in zip(records, TEXTS):
+        if isinstance(text, str):
+            assert (fields, error) == (logic.extract_kyc_fields(text), None)
+        else:
+            # A broken record is reported on the error channel and the batch goes on
+            assert fields == {}
+            assert error.startswith("AttributeError: ")
@@ -0,0 +1,55 @@
+import csv
+import io
+import zipfile
+
+import logic
+
+TEXTS = [
+    "Name: John\nCountry: China",
+    "Name: =HYPERLINK(\"http://x\")\nCountry: China\nDevice ID: @abc",
+    None,
+    "姓名: 张三\n证件号码: -12",
+]
+
+
+def _expected_rows(store):
+    for idx, text in enumerate(TEXTS):
+        fields = logic.extract_kyc_fields(text) if isinstance(text, str) else {}
+        yield [fields.get(key, "") for key in store.keys], store.error(idx) or ""
+
+
+def test_csv_export_matches_extraction():
+    store = logic.KYCResultStore.from_texts(TEXTS)
+    out = io.StringIO(newline="")
+    store.write_csv(out)
+    raw = io.StringIO(newline="")
+    store.write_csv(raw, escape_formulas=False)
+
+    header, *rows = csv.reader(io.StringIO(out.getvalue()))
+    assert header == store.headers()
+    raw_rows = list(csv.reader(io.StringIO(raw.getvalue())))[1:]
+    position = 0
+    for row, raw_row, (values, error), text in zip(rows, raw_rows, _expected_rows(store), TEXTS):
+        length = len(text) if isinstance(text, str) else 0
+        assert raw_row == values + [error, str(position), str(position + length)]
+        # Only cells a spreadsheet would evaluate get the apostrophe
+        assert row[:len(values)] == ["'" + v if v[:1] in ("=", "+", "-", "@") else v for v in values]
+        position += length
+    assert rows[1][store.keys.index("name")] == "'=HYPERLINK(\"http://x\")"
+    assert rows[2][len(store.keys)].startswith("AttributeError: ")
+
+
+def test_xlsx_export_matches_extraction():
+    store = logic.KYCResultStore.from_texts(TEXTS)
+    out = io.BytesIO()
+    store.write_xlsx(out)
+
+    letters = [logic._xlsx_column_letters(idx) for idx in range(len(store.keys) + 3)]
+    header, *rows = [[cells.get(letter, "") for letter in letters] for cells in logic._xlsx_rows(out.getvalue())]
+    assert header == store.headers()
+    for row, (values, error), idx in zip(rows, _expected_rows(store), range(len(TEXTS))):
+        # Values are stored as strings, so formulas are never evaluated and need no escaping
+        assert row == values + [error] + [str(n) for n in store.span(idx)]
+    assert len(rows) == len(TEXTS)
+    with zipfile.ZipFile(out) as package:
+        assert b"<f>" not in package.read("xl/worksheets/sheet1.xml")
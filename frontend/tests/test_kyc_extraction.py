@@ -0,0 +1,43 @@
+import pytest
+
+import logic
+
+
+@pytest.mark.parametrize("text, expected", [
+    # re.IGNORECASE matches these, though their lower() is not the label's
+    ("ſubmit ip: 1.2.3.4", {"submit_ip": "1.2.3.4"}),
+    ("Submıt IP: 1", {"submit_ip": "1"}),
+    ("SUBMİT IP: 2", {"submit_ip": "2"}),
+    ("Name: A  ſubmit ip: 3", {"name": "A  ſubmit ip: 3", "submit_ip": "3"}),
+])
+def test_case_insensitive_labels(text, expected):
+    assert logic.extract_kyc_fields(text) == expected
+
+
+@pytest.mark.parametrize("text, key, value", [
+    ("Submit  lP: 1.2.3.4", "submit_ip", "1.2.3.4"),
+    ("证件 号码: E1234567", "id_number", "E1234567"),
+    # The noisy full label beats its exact prefix "Submit Device"
+    ("Submit Device lD: abc123", "device_id", "abc123"),
+])
+def test_fuzzy_labels(text, key, value):
+    scores = {}
+    assert logic.extract_kyc_fields(text, fuzzy=True, scores=scores) == {key: value}
+    assert 0 < scores[key] <= 1
+
+
+def test_fuzzy_keeps_exact_labels():
+    scores = {}
+    fields = logic.extract_kyc_fields("Submit Device ID: x\nName: John", fuzzy=True, scores=scores)
+    assert fields == {"device_id": "x", "name": "John"}
+    assert scores == {"device_id": 1.0, "name": 1.0}
+
+
+@pytest.mark.parametrize("text", [
+    # One edit away from "Expired" / "ID Expired", but a different word
+    "Expires: 2030-01-01",
+    "ID Expires: 2030-01-01",
+    "Submitted IP: 1.2.3.4",
+])
+def test_fuzzy_rejects_other_words(text):
+    assert logic.extract_kyc_fields(text, fuzzy=True) == {}
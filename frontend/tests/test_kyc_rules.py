@@ -0,0 +1,89 @@
+import io
+import os
+import zipfile
+from xml.sax.saxutils import escape
+
+import pytest
+
+import logic
+from conftest import HERE, TEMPLATES
+
+OPS_SHEET = os.path.join(HERE, "..", "..", "正则表达式优化与汇总 (1).xlsx")
+
+
+def _sheet(rows):
+    """A minimal one-sheet .xlsx with inline-string cells."""
+    xml_rows = "".join(
+        f'<row r="{r}">' + "".join(
+            f'<c r="{chr(65 + c)}{r}" t="inlineStr"><is><t>{escape(text)}</t></is></c>'
+            for c, text in enumerate(row)
+        ) + "</row>"
+        for r, row in enumerate(rows, 1)
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr(
+            "xl/worksheets/sheet1.xml",
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            f"<sheetData>{xml_rows}</sheetData></worksheet>",
+        )
+    return buffer.getvalue()
+
+
+def test_sheet_rows_outside_kyc_are_skipped():
+    blob = _sheet([
+        ["Form Field (Label)", "Word Template Field (Key)"],
+        ["Listing Fee amount:", "amount"],
+        ["Sex:", "gender"],
+    ])
+    rules = logic.load_kyc_rules(blob)
+    assert "amount" not in rules.labels
+    assert "Sex" in rules.labels["gender"]
+    logic.use_kyc_rules(rules)
+    try:
+        assert logic.extract_kyc_fields("Listing Fee amount: 10000\nSex: 男") == {"gender": "Male"}
+    finally:
+        logic.use_kyc_rules(None)
+
+
+def test_sheet_without_kyc_rows_is_rejected():
+    blob = _sheet([["Form Field (Label)", "Word Template Field (Key)"], ["Company name:", "company"]])
+    with pytest.raises(ValueError):
+        logic.load_kyc_rules(blob)
+
+
+@pytest.mark.skipif(not os.path.exists(OPS_SHEET), reason="ops sheet not present")
+def test_listing_form_sheet_is_rejected():
+    with pytest.raises(ValueError):
+        logic.load_kyc_rules(OPS_SHEET)
+
+
+def test_rules_are_part_of_kyc_render_keys():
+    with open(os.path.join(TEMPLATES, "KYC.docx"), "rb") as handle:
+        template = handle.read()
+    data = {"name": "Jane Roe", "gender": "Female"}
+    rules = logic.load_kyc_rules(b'{"template_aliases": {"Full name": "Name"}}')
+
+    builtin_key = logic.render_cache_key("kyc", template, data, "1")
+    builtin_compiled = logic.get_compiled_kyc_template(template)
+    logic.use_kyc_rules(rules)
+    try:
+        assert logic.render_cache_key("kyc", template, data, "1") != builtin_key
+        compiled = logic.get_compiled_kyc_template(template)
+        assert compiled is not builtin_compiled
+        assert compiled.rules_fingerprint == rules.fingerprint
+        assert logic.get_compiled_kyc_template(template) is compiled
+        # A template compiled under other rules keeps keying by those rules
+        assert logic.render_cache_key("kyc", builtin_compiled, data, "1") == builtin_key
+    finally:
+        logic.use_kyc_rules(None)
+    assert logic.get_compiled_kyc_template(template) is builtin_compiled
+
+
+def test_value_maps_keep_the_builtin_cleanup():
+    logic.use_kyc_rules(logic.load_kyc_rules(b'{"value_maps": {"device_id": {"x": "y"}}}'))
+    try:
+        assert logic.extract_kyc_fields("Device ID: ID: abc") == {"device_id": "abc"}
+        assert logic.extract_kyc_fields("Device ID: ID: x") == {"device_id": "y"}
+    finally:
+        logic.use_kyc_rules(None)
@@ -0,0 +1,25 @@
+import random
+
+import logic
+
+LINES = [
+    "Name: John", "Name:", "John Smith", "Country:", " ", "China", "Submit IP: 1.2.3.4",
+    "Device ID: ID: abc", "证件号码:", "E1234567", "Some note", "Gender: 男", "Expired:", "No",
+]
+
+
+def test_session_matches_full_extraction_after_edits():
+    rng = random.Random(14)
+    lines = [rng.choice(LINES) for _ in range(20)]
+    session = logic.KYCExtractionSession("\n".join(lines))
+    for _ in range(300):
+        start = rng.randrange(len(lines) + 1)
+        end = min(len(lines), start + rng.randrange(3))
+        new = [rng.choice(LINES) for _ in range(rng.randrange(3))]
+        lines[start:end] = new
+        if rng.random() < 0.5:
+            fields = session.edit(start, end, "\n".join(new))
+        else:
+            fields = session.set_text("\n".join(lines))
+        assert session.text == "\n".join(lines)
+        assert fields == session.fields == logic.extract_kyc_fields(session.text)
@@ -0,0 +1,16 @@
+from docx import Document
+
+import logic
+
+
+def test_empty_mapping_leaves_text_alone():
+    paragraph = Document().add_paragraph("a {{}} b {{x}}")
+    logic.replace_placeholders_in_paragraph(paragraph, {})
+    assert paragraph.text == "a {{}} b {{x}}"
+
+
+def test_placeholder_split_across_runs():
+    paragraph = Document().add_paragraph("Dear {{ com")
+    paragraph.add_run("pany }}, welcome")
+    logic.replace_placeholders_in_paragraph(paragraph, {"company": "ACME"})
+    assert [run.text for run in paragraph.runs] == ["Dear ACME", ", welcome"]
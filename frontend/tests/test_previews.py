@@ -0,0 +1,51 @@
+import io
+
+import pytest
+from docx import Document
+
+import logic
+from conftest import LISTING_DATA_SETS, read_template, story_xml
+
+
+@pytest.mark.parametrize("template_name", ["Company.docx", "Company Waive.docx"])
+def test_reused_listing_previews_match_a_fresh_preview(template_name):
+    template = read_template(template_name)
+    compiled = logic.CompiledListingTemplate(template)
+    session = logic.ListingPreviewSession(template)
+    # Twice round, so every data set follows a different one in the session
+    for data in LISTING_DATA_SETS * 2:
+        expected = logic.preview_listing_agreement(template, data)
+        assert compiled.preview(data) == expected
+        assert session.preview(data) == expected
+        session.update(data)
+        assert session.preview(dict(data)) == expected
+
+
+@pytest.mark.parametrize("template_name", ["Company.docx", "Company Waive.docx"])
+def test_session_renders_match_full_renders(template_name):
+    template = read_template(template_name)
+    session = logic.ListingPreviewSession(template)
+    edits = [dict(LISTING_DATA_SETS[0], company=company) for company in ("A", "A {{token}}", "")]
+    edits += [dict(edits[-1], includeTechnicalFee=False), dict(edits[-1], wallets={"bsc": "0x2"})]
+    # Whole data sets swapped, then one field edited at a time, as the form does
+    for data in LISTING_DATA_SETS * 2 + edits:
+        expected = story_xml(logic.generate_listing_agreement(template, data))
+        assert story_xml(session.update(data)) == expected
+
+
+def test_listing_preview_text_matches_the_render():
+    template = read_template("Company Waive.docx")
+    data = LISTING_DATA_SETS[0]
+    document = Document(io.BytesIO(logic.generate_listing_agreement(template, data)))
+    blocks = logic.preview_listing_agreement(logic.CompiledListingTemplate(template), data)
+    assert [block["text"] for block in blocks if block["type"] == "paragraph"] == [p.text for p in document.paragraphs]
+
+
+def test_compiled_kyc_preview_matches_a_fresh_preview():
+    template = read_template("KYC.docx")
+    compiled = logic.CompiledKYCTemplate(template)
+    images = [b"first", b"second", b"first"]
+    for data, account_id in [({"name": "Jane Roe", "country": "China", "id_number": "123"}, "10001"), ({}, "")]:
+        expected = logic.preview_kyc_document(template, data, account_id, images)
+        assert compiled.preview(data, account_id, images) == expected
+    assert [block["ref"] for block in expected if block["type"] == "image"] == [0, 1]
@@ -0,0 +1,37 @@
+import os
+
+import logic
+
+
+def test_disk_tier_prunes_oldest_entries(tmp_path):
+    cache = logic.RenderCache(max_bytes=0, directory=str(tmp_path), max_disk_bytes=250)
+    for index, key in enumerate(["a", "b", "c"]):
+        cache.put(key, b"x" * 100)
+        os.utime(tmp_path / f"{key}.docx", (index, index))
+    cache.put("d", b"x" * 100)
+
+    assert sorted(os.listdir(tmp_path)) == ["c.docx", "d.docx"]
+    assert cache.get("a") is None
+    assert cache.get("d") == b"x" * 100
+    assert cache.stats()["disk_evictions"] == 2
+
+
+def test_disk_errors_are_misses(tmp_path):
+    cache = logic.RenderCache(max_bytes=0, directory=str(tmp_path / "cache"))
+    os.rmdir(cache.directory)
+    # A directory where the entry should be makes both open() calls fail
+    os.makedirs(os.path.join(cache.directory, "k.docx"))
+
+    cache.put("k", b"blob")
+    assert cache.get("k") is None
+    assert os.listdir(cache.directory) == ["k.docx"]
+
+
+def test_unusable_directory_disables_disk_tier(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_bytes(b"")
+    cache = logic.RenderCache(directory=str(blocker / "cache"))
+
+    assert cache.directory is None
+    cache.put("k", b"blob")
+    assert cache.get("k") == b"blob"
@@ -0,0 +1,99 @@
+import http.client
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import logic
+from conftest import HERE, LISTING_DATA_SETS, read_template, story_xml
+
+sys.path.insert(0, os.path.join(HERE, "..", "service"))
+
+import logic_service  # noqa: E402
+
+
+def _serve(**kwargs):
+    server = logic_service.LogicService(("127.0.0.1", 0), workers=1, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _stop(server):
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="module")
+def service():
+    server = _serve()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    _stop(server)
+
+
+def _post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), method="POST")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as exc:
+        with exc:
+            return exc.code, exc.headers, exc.read()
+
+
+def test_extract(service):
+    status, _headers, body = _post(service + "/kyc/extract", {"text": "Name: John\nCountry: China"})
+    assert status == 200
+    assert json.loads(body) == {"fields": {"name": "John", "country": "China"}}
+
+
+def test_listing(service):
+    status, headers, body = _post(service + "/listing", {"template": "Company.docx", "data": LISTING_DATA_SETS[0]})
+    assert status == 200
+    assert headers["Content-Type"] == logic_service.DOCX_MIME
+    expected = logic.generate_listing_agreement(read_template("Company.docx"), LISTING_DATA_SETS[0])
+    assert story_xml(body) == story_xml(expected)
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/kyc/extract", []),
+    ("/kyc/extract", "x"),
+    ("/kyc/extract", {"text": 5}),
+    ("/listing", {"template": "Company.docx", "data": [1]}),
+    ("/listing", {"template": "Missing.docx"}),
+    ("/kyc", {"images": ["not base64!"]}),
+    ("/kyc", {"images": [5]}),
+])
+def test_bad_requests(service, path, body):
+    status, _headers, response = _post(service + path, body)
+    assert status == 400
+    assert "error" in json.loads(response)
+
+
+def test_unknown_path_keeps_the_connection_usable(service):
+    connection = http.client.HTTPConnection(service[len("http://"):])
+    try:
+        connection.request("POST", "/nope", body=b'{"text": "Name: John"}')
+        response = connection.getresponse()
+        response.read()
+        assert response.status == 404
+        connection.request("GET", "/healthz")
+        response = connection.getresponse()
+        assert response.status == 200 and json.loads(response.read()) == {"ok": True}
+    finally:
+        connection.close()
+
+
+def test_full_service_rejects_with_503():
+    server = _serve(max_pending=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        status, headers, _body = _post(url + "/kyc/extract", {"text": "Name: John"})
+        assert status == 503
+        assert headers["Retry-After"] == "1"
+        assert server.metrics.snapshot()["rejected"] == 1
+    finally:
+        _stop(server)
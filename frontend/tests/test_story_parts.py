@@ -0,0 +1,60 @@
+import io
+import re
+
+from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from docx.text.paragraph import Paragraph
+
+import logic
+from conftest import LISTING_DATA_SETS, read_template, story_xml
+
+TEXT_BOX = (
+    f'<w:r {nsdecls("w")} xmlns:v="urn:schemas-microsoft-com:vml"><w:pict><v:shape><v:textbox><w:txbxContent>'
+    "<w:p><w:r><w:t>Box: {{company}}</w:t></w:r></w:p>"
+    "</w:txbxContent></v:textbox></v:shape></w:pict></w:r>"
+)
+
+
+def _template_with_story_placeholders():
+    doc = Document(io.BytesIO(read_template("Company.docx")))
+    section = doc.sections[0]
+    section.header.is_linked_to_previous = False
+    section.header.add_paragraph("Header: {{company}}")
+    section.footer.is_linked_to_previous = False
+    table = section.footer.add_table(1, 2, section.page_width)
+    table.cell(0, 0).text = "Footer: {{token}}"
+    table.cell(0, 1).merge(table.cell(0, 0))
+    doc.add_paragraph("Body").add_run()._r.addnext(parse_xml(TEXT_BOX))
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def test_story_paragraphs_reach_headers_footers_and_text_boxes():
+    doc = Document(io.BytesIO(_template_with_story_placeholders()))
+    section = doc.sections[0]
+    parts = [doc.part, section.header.part, section.footer.part]
+    expected = [(part, p) for part in parts for p in part.element.iter(logic._W_P)]
+
+    visited = list(logic.iter_story_paragraphs(doc))
+    # Each paragraph exactly once, the merged footer cell included
+    assert len(visited) == len(set(visited)) == len(expected)
+    assert set(visited) == set(expected)
+
+
+def test_story_placeholders_match_body_placeholders():
+    template = _template_with_story_placeholders()
+    data = LISTING_DATA_SETS[0]
+    rendered = logic.generate_listing_agreement(template, data)
+    compiled = logic.generate_listing_agreement(logic.CompiledListingTemplate(template), data)
+    assert story_xml(compiled) == story_xml(rendered)
+
+    texts = {"document": [], "header": [], "footer": []}
+    for part, p in logic.iter_story_paragraphs(Document(io.BytesIO(rendered))):
+        kind = re.sub(r"\d*\.xml$", "", part.partname.rsplit("/", 1)[-1])
+        texts[kind].append(logic._paragraph_text(Paragraph(p, None)))
+    assert f"Box: {data['company']}" in texts["document"]
+    assert f"Header: {data['company']}" in texts["header"]
+    assert f"Footer: {data['token']}" in texts["footer"]
+    assert not any("{{company}}" in text or "{{token}}" in text for kind_texts in texts.values() for text in kind_texts)